@@ -24,6 +24,7 @@
 
 
 import json
+import logging
 import sys
 import time
 import random
@@ -37,12 +38,16 @@ from skunkworksCSS import getCSS_BulkStatus
 from skunkworksCSS import getCSS_BulkContent
 from skunkworksCSS import clearCSS_BulkRequests
 from skunkworksCSS import getCSS_ObjectContent
+from skunkworksMetrics import getRegistry
 
 # The credentials generated in the Admin console should live in the file specified here.
 # Use an external file like this, or an enviornment variable. Don't put keys in your code.
 
 credentials = 'creds.json'
 
+# The libraries report progress through the logging module.
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
 # Feed the credentials to the clientCredentialsAuthorize() function, which will
 # use them to build a request to the authentication server. If the request is successful,
 # a bearer token in returned. The accompanies any requests to the CSS endpoint.
@@ -91,6 +96,10 @@ print('getCSS_ObjectsList returned', len(objectList), 'items.')
 # Pass your token to clearCSS_BulkRequests()
 # Wait
 # Check Status with getCSS_BulkStatus()
+#
+# downloadCSS_Bulk() runs all of these steps for you, and downloads each zip as
+# soon as it is ready instead of waiting for all of them:
+# downloadCSS_Bulk(token, ids, directory='.')
 
 ################################################################################
 
@@ -132,3 +141,6 @@ response = clearCSS_BulkRequests(token)
 print(response)
 
 print('Finished.')
+
+# Every request made above was timed and counted. Print the totals.
+print(getRegistry().toJSON(indent=4))
@@ -39,11 +39,30 @@
 
 import base64
 import json
+import os
 import requests
+import threading
 import time
 from requests_oauth2 import OAuth2BearerToken
 
-def clientCredentialsAuthorize(credentials='creds.json', authendpoint='https://api.8x8.com/oauth/v2/token'):
+import skunkworksMetrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Auth server requests are timed and recorded in skunkworksMetrics, in the
+# process wide registry unless a MetricsRegistry is passed as metrics.
+def _post(url, metrics=None, **kwargs):
+    metrics = metrics or skunkworksMetrics.getRegistry()
+    started = time.time()
+    response = requests.post(url, **kwargs)
+    metrics.request('auth', skunkworksMetrics.endpointOf(url), 'POST', response.status_code, time.time() - started,
+                    len(response.content), skunkworksMetrics.bodySize(response.request))
+    return response
+
+def clientCredentialsAuthorize(credentials='creds.json', authendpoint='https://api.8x8.com/oauth/v2/token', metrics=None):
     # Credentials for the appliction are stored in a json formatted file
     with open(credentials) as f:
         content = f.read()
@@ -66,7 +85,7 @@ def clientCredentialsAuthorize(credentials='creds.json', authendpoint='https://a
     my_data = {'grant_type': 'client_credentials'}
 
     # Send request to authendpoint.
-    response = requests.post(authendpoint, data=my_data, headers=authheader)
+    response = _post(authendpoint, metrics, data=my_data, headers=authheader)
 
     if (response.status_code == 200):
         result = response.json()
@@ -109,7 +128,7 @@ def clientCredentialsAuthorize(credentials='creds.json', authendpoint='https://a
 # *** Store the key pair in a file as formatted above ***
 # *** DO NOT PUT CREDENTIALS IN YOUR CODE ***
 
-def vccJWTauthorize(credentials='vccchat.creds', authendpoint='https://api.8x8.com/vcc/chat/v1/authorize'):
+def vccJWTauthorize(credentials='vccchat.creds', authendpoint='https://api.8x8.com/vcc/chat/v1/authorize', metrics=None):
     with open(credentials) as f:
         content = f.read()
     creds = json.loads(content)
@@ -129,7 +148,7 @@ def vccJWTauthorize(credentials='vccchat.creds', authendpoint='https://api.8x8.c
                   '8x8-apikey': apigeeAPI,
                   'Content-type': 'application/x-www-form-urlencoded'}
 
-    response = requests.post(requestUrl, headers=authheader)
+    response = _post(requestUrl, metrics, headers=authheader)
 
     if (response.status_code == 200):
         result = response.json()
@@ -140,3 +159,144 @@ def vccJWTauthorize(credentials='vccchat.creds', authendpoint='https://api.8x8.c
         return result
     else:
         return response.json()
+
+################################################################################
+# TokenProvider caches the result of an authorize function and hands out the
+# token until it is close to expiring, then fetches a new one.
+# Pass the provider to any skunkworksCSS function or CSSClient in place of the
+# raw token string. A request that comes back 401 drops the cached token and
+# is retried once with a fresh one.
+#
+# authorize     - clientCredentialsAuthorize (default) or vccJWTauthorize
+# credentials   - credentials file handed to authorize
+# authendpoint  - auth server url handed to authorize (default: authorize's own)
+# cacheFile     - optional json file shared between processes. Reads and
+#                 refreshes take an exclusive lock on cacheFile + '.lock', so a
+#                 pool of short jobs fetches one token between them.
+# refreshMargin - seconds before expiry at which the token is renewed
+#
+# ex: provider = TokenProvider(credentials='creds.json', cacheFile='/tmp/css-token.json')
+#     objects = getCSS_ObjectsList(provider)
+
+class TokenProvider:
+    def __init__(self, authorize=clientCredentialsAuthorize, credentials='creds.json', authendpoint=None, cacheFile=None, refreshMargin=300):
+        self.authorize = authorize
+        self.credentials = credentials
+        self.authendpoint = authendpoint
+        self.cacheFile = cacheFile
+        self.refreshMargin = refreshMargin
+        self._result = None
+        self._lock = threading.Lock()
+
+    # Returns the bearer token string, refreshing it first if needed.
+    def getToken(self):
+        return tokenOf(self.getResult())
+
+    # Returns the full authorize() result for the current token.
+    def getResult(self):
+        with self._lock:
+            if not self._isFresh(self._result):
+                self._result = self._load()
+            return self._result
+
+    # Forgets the current token, so the next getToken() fetches a new one.
+    # Pass the token that was rejected: it is only dropped if it is still the
+    # current one, so when many requests fail with the same token at once,
+    # only one new token is fetched, and a token another process has already
+    # put in cacheFile is left alone.
+    def invalidate(self, token=None):
+        with self._lock:
+            stale = self._result
+            if token is not None and (stale is None or tokenOf(stale) != token):
+                return
+            self._result = None
+            if self.cacheFile:
+                with self._fileLock():
+                    cached = self._readCache()
+                    if cached is not None and cached == stale:
+                        self._writeCache(None)
+
+    def _isFresh(self, result):
+        if not result:
+            return False
+        return expiryOf(result) - self.refreshMargin > time.time()
+
+    def _authorize(self):
+        if self.authendpoint:
+            result = self.authorize(credentials=self.credentials, authendpoint=self.authendpoint)
+        else:
+            result = self.authorize(credentials=self.credentials)
+        if tokenOf(result) is None:
+            raise RuntimeError('Authorization failed: ' + json.dumps(result))
+        return result
+
+    def _load(self):
+        if not self.cacheFile:
+            return self._authorize()
+        with self._fileLock():
+            result = self._readCache()
+            if not self._isFresh(result):
+                result = self._authorize()
+                self._writeCache(result)
+            return result
+
+    def _cacheKey(self):
+        return os.path.abspath(self.credentials) + '|' + str(self.authendpoint or self.authorize.__name__)
+
+    def _readCache(self):
+        try:
+            with open(self.cacheFile) as f:
+                return json.load(f).get(self._cacheKey())
+        except (OSError, ValueError):
+            return None
+
+    def _writeCache(self, result):
+        try:
+            with open(self.cacheFile) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        if result is None:
+            cache.pop(self._cacheKey(), None)
+        else:
+            cache[self._cacheKey()] = result
+        tmpfile = self.cacheFile + '.' + str(os.getpid()) + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump(cache, f)
+        os.chmod(tmpfile, 0o600)
+        os.replace(tmpfile, self.cacheFile)
+
+    def _fileLock(self):
+        return _FileLock(self.cacheFile + '.lock')
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def __enter__(self):
+        self.handle = open(self.path, 'a')
+        if fcntl:
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.handle.close()
+
+################################################################################
+# tokenOf() and expiryOf() read the token and its expiry time (epoch seconds)
+# out of either authorize function's result.
+# clientCredentialsAuthorize: access_token, issued_at + expires_in
+# vccJWTauthorize: token, expireAt
+
+def tokenOf(result):
+    return result.get('access_token') or result.get('token')
+
+def expiryOf(result):
+    if 'expireAt' in result:
+        return int(result['expireAt'])
+    if 'expires_in' in result:
+        return int(result.get('issued_at', 0)) + int(result['expires_in'])
+    return 0
@@ -0,0 +1,476 @@
+# skunkworksBench measures how fast the skunkworksCSS and skunkworksAuth
+# functions run, without a live 8x8 tenant.
+
+# It starts a local stand-in for the CSS v3 API and the OAuth token endpoint in
+# a separate process, points the libraries at it, and times each operation.
+# The stand-in server has configurable latency, object count, payload size,
+# zip build time and error rate, so slow networks, large tenants and a flaky
+# API can all be reproduced offline.
+
+# Each benchmark calls the public function that it is named after.
+# For every benchmark the report shows operations per second, bytes per second,
+# p50/p95/p99 latency per call, the number of HTTP requests made and their own
+# p50/p95/p99 latency (taken from the skunkworksMetrics registry), and peak
+# Python memory (tracemalloc) in the client.
+
+# ex: python skunkworksBench.py
+#     python skunkworksBench.py --objects 20000 --latency 0.02 --payload 65536 --errors 0.01
+#     python skunkworksBench.py --only list,content --json results.json
+
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import skunkworksCSS
+from skunkworksAuth import clientCredentialsAuthorize
+from skunkworksAuth import TokenProvider
+from skunkworksAuth import vccJWTauthorize
+from skunkworksMetrics import getRegistry
+
+
+################################################################################
+# The stand-in server.
+# Objects are generated from their index, so the server holds no content:
+# object i has id 'obj-000000i', a payload of `payload` bytes derived from its
+# id, and an MD5 checksum in its metadata. Object i was created i minutes
+# after MOCK_EPOCH. Listing pages by pageKey/limit, honours sortDirection and
+# createdTime/updatedTime ranges in the filter (other filter terms are
+# ignored) and reports lastPage on the final page; unknown ids answer 404.
+# Bulk requests are split into zips of `zipSize` ids, each DONE `zipDelay`
+# seconds after it was requested. Both token endpoints are served:
+# /oauth/v2/token and /vcc/chat/v1/authorize.
+# With `errors` > 0, that fraction of requests (other than the token request)
+# answers 503 with Retry-After: 0.
+
+MOCK_EPOCH = 1600000000
+
+# A createdTime/updatedTime range term of a listing filter,
+# ex: 'createdTime=ge=2020-09-13T12:26:40Z'.
+_MOCK_RANGE_TERM = re.compile(r'(?:createdTime|updatedTime)=(ge|gt|le|lt)=(.+)')
+
+def _objectId(index):
+    return 'obj-%08d' % index
+
+# The index of an id this server hands out, or None.
+def _objectIndex(objectId, objects):
+    match = re.fullmatch(r'obj-(\d{8})', objectId)
+    if not match or int(match.group(1)) >= objects:
+        return None
+    return int(match.group(1))
+
+# The range [first, last) of indexes whose objects match the time range terms
+# of filter. Times are read in skunkworksCSS.CSS_TIME_FORMAT or in the
+# format the server writes them in.
+def _objectRange(filter, objects):
+    import calendar
+    first, last = 0, objects
+    for term in filter.split(','):
+        match = _MOCK_RANGE_TERM.fullmatch(term.strip())
+        if not match:
+            continue
+        for timeFormat in (skunkworksCSS.CSS_TIME_FORMAT, '%Y-%m-%dT%H:%M:%S.000+0000'):
+            try:
+                seconds = calendar.timegm(time.strptime(match.group(2), timeFormat)) - MOCK_EPOCH
+                break
+            except ValueError:
+                seconds = None
+        if seconds is None:
+            continue
+        below, above = seconds // 60, -(-seconds // 60)
+        if match.group(1) == 'ge':
+            first = max(first, above)
+        elif match.group(1) == 'gt':
+            first = max(first, below + 1)
+        elif match.group(1) == 'lt':
+            last = min(last, above)
+        else:
+            last = min(last, below + 1)
+    return max(first, 0), max(min(last, objects), 0)
+
+def _objectContent(objectId, payload):
+    seed = hashlib.sha256(objectId.encode('ascii')).digest()
+    return (seed * (payload // len(seed) + 1))[:payload]
+
+def _objectMetaData(index, payload):
+    objectId = _objectId(index)
+    created = time.strftime('%Y-%m-%dT%H:%M:%S.000+0000', time.gmtime(MOCK_EPOCH + index * 60))
+    return {'id': objectId,
+            'bucketId': 'bucket-%d' % (index % 4),
+            'customerId': 'customer-1',
+            'userId': 'user-%d' % (index % 50),
+            'type': ('callrecording', 'callcenterrecording', 'voicemail')[index % 3],
+            'mimeType': 'audio/wav',
+            'objectName': objectId + '.wav',
+            'objectState': 'AVAILABLE',
+            'createdTime': created,
+            'updatedTime': created,
+            'storedBytes': payload,
+            'checksum': hashlib.md5(_objectContent(objectId, payload)).hexdigest(),
+            'checksumType': 'MD5'}
+
+class _MockState:
+    def __init__(self, config):
+        self.config = config
+        self.zips = {}
+        self.lock = threading.Lock()
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', contentType='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sendRange(self, data, contentType):
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if not match:
+            self._send(200, data, contentType, {'Accept-Ranges': 'bytes'})
+            return
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(data) - 1
+        if start >= len(data):
+            self._send(416, b'', contentType, {'Content-Range': 'bytes */' + str(len(data))})
+            return
+        end = min(end, len(data) - 1)
+        self._send(206, data[start:end + 1], contentType, {'Content-Range': 'bytes %d-%d/%d' % (start, end, len(data))})
+
+    def _handle(self, method):
+        state = self.server.state
+        config = state.config
+        url = urlparse(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+        body = b''
+        if 'Content-Length' in self.headers:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+
+        if config['latency']:
+            time.sleep(config['latency'])
+
+        if path == '/oauth/v2/token':
+            self._send(200, {'access_token': 'mock-token', 'token_type': 'bearer', 'expires_in': 1800})
+            return
+        if path == '/vcc/chat/v1/authorize':
+            self._send(200, {'token': 'mock-jwt'})
+            return
+        if config['errors'] and random.random() < config['errors']:
+            self._send(503, {'error': 'injected'}, headers={'Retry-After': '0'})
+            return
+
+        match = re.match(r'^/storage/[^/]+/v3(/.*)$', path)
+        route = match.group(1) if match else ''
+        parts = route.strip('/').split('/')
+
+        if method == 'GET' and route == '/objects':
+            pageKey = int(query.get('pageKey', ['0'])[0])
+            limit = int(query.get('limit', ['100'])[0])
+            first, last = _objectRange(query.get('filter', [''])[0], config['objects'])
+            end = min(pageKey + limit, max(last - first, 0))
+            if query.get('sortDirection', ['ASC'])[0] == 'DESC':
+                indexes = range(last - 1 - pageKey, last - 1 - end, -1)
+            else:
+                indexes = range(first + pageKey, first + end)
+            content = [_objectMetaData(i, config['payload']) for i in indexes]
+            self._send(200, {'content': content, 'lastPage': end >= last - first})
+        elif method == 'GET' and len(parts) == 3 and parts[0] == 'objects' and _objectIndex(parts[1], config['objects']) is None:
+            self._send(404, {'error': 'unknown object'})
+        elif method == 'GET' and len(parts) == 3 and parts[0] == 'objects' and parts[2] == 'metadata':
+            self._send(200, _objectMetaData(_objectIndex(parts[1], config['objects']), config['payload']))
+        elif method == 'GET' and len(parts) == 3 and parts[0] == 'objects' and parts[2] == 'content':
+            self._sendRange(_objectContent(parts[1], config['payload']), 'application/octet-stream')
+        elif method == 'POST' and route == '/bulk/download/start':
+            ids = json.loads(body or b'[]')
+            zips = []
+            with state.lock:
+                for start in range(0, len(ids), config['zipSize']):
+                    zipName = '%s.zip' % hashlib.md5(('%f-%d' % (time.time(), len(state.zips))).encode('ascii')).hexdigest()
+                    state.zips[zipName] = {'ids': ids[start:start + config['zipSize']], 'readyAt': time.time() + config['zipDelay'], 'data': None}
+                    zips.append({'zipName': zipName, 'status': 'NOT_STARTED'})
+            self._send(200, zips)
+        elif method == 'GET' and route.startswith('/bulk/download/status'):
+            with state.lock:
+                statuses = [{'zipName': name, 'status': 'DONE' if time.time() >= item['readyAt'] else 'IN_PROGRESS'} for name, item in state.zips.items()]
+            if len(parts) == 4:
+                matches = [item for item in statuses if item['zipName'] == parts[3]]
+                if matches:
+                    self._send(200, matches[0])
+                else:
+                    self._send(404, {'error': 'unknown zip'})
+            else:
+                self._send(200, statuses)
+        elif method == 'PUT' and route == '/bulk/download/clear':
+            with state.lock:
+                state.zips.clear()
+            self._send(200, {})
+        elif method == 'GET' and len(parts) == 3 and parts[0] == 'bulk' and parts[1] == 'download':
+            with state.lock:
+                item = state.zips.get(parts[2])
+                if item is not None and item['data'] is None:
+                    archive = io.BytesIO()
+                    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+                        for objectId in item['ids']:
+                            zf.writestr(objectId + '.wav', _objectContent(objectId, config['payload']))
+                    item['data'] = archive.getvalue()
+            if item is None:
+                self._send(404, {'error': 'unknown zip'})
+            else:
+                self._sendRange(item['data'], 'application/zip')
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+def _serve(config, ports):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _MockHandler)
+    server.daemon_threads = True
+    server.state = _MockState(config)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+################################################################################
+# MockCSSServer runs the stand-in server in a child process, so its memory and
+# CPU do not show up in the client measurements.
+# ex: with MockCSSServer(objects=1000, latency=0.01) as server:
+#         client = CSSClient('mock-token', baseUrl=server.baseUrl + '/storage')
+
+class MockCSSServer:
+    def __init__(self, objects=1000, payload=32768, latency=0.0, errors=0.0, zipSize=100, zipDelay=0.5):
+        self.config = {'objects': objects, 'payload': payload, 'latency': latency,
+                       'errors': errors, 'zipSize': zipSize, 'zipDelay': zipDelay}
+        self.process = None
+        self.baseUrl = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        ports = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_serve, args=(self.config, ports), daemon=True)
+        self.process.start()
+        self.baseUrl = 'http://127.0.0.1:' + str(ports.get(timeout=10))
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+
+################################################################################
+# measure() runs operation() `repeat` times and returns its statistics.
+# operation returns the number of bytes it moved (or None), which feeds the
+# bytes per second figure. count is the number of operations one call stands
+# for, ex: the objects in one listing.
+# With a registry (skunkworksMetrics.MetricsRegistry), every HTTP request the
+# timed runs make is collected through a hook, for per-request percentiles.
+# tracemalloc slows Python down considerably, so timings come from untraced
+# runs and peak memory from one extra, traced run.
+
+def measure(name, operation, repeat=1, count=1, registry=None):
+    latencies = []
+    requests = []
+    moved = 0
+
+    def hook(event):
+        if event['type'] == 'request':
+            requests.append(event['seconds'])
+
+    if registry is not None:
+        registry.addHook(hook)
+    started = time.perf_counter()
+    try:
+        for i in range(repeat):
+            opStarted = time.perf_counter()
+            moved = moved + (operation() or 0)
+            latencies.append(time.perf_counter() - opStarted)
+        elapsed = time.perf_counter() - started
+    finally:
+        if registry is not None:
+            registry.removeHook(hook)
+
+    tracemalloc.start()
+    operation()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    requests.sort()
+    return {'name': name,
+            'operations': repeat * count,
+            'seconds': elapsed,
+            'opsPerSecond': repeat * count / elapsed if elapsed else 0.0,
+            'bytesPerSecond': moved / elapsed if elapsed else 0.0,
+            'p50': _percentile(latencies, 50),
+            'p95': _percentile(latencies, 95),
+            'p99': _percentile(latencies, 99),
+            'requests': len(requests),
+            'requestP50': _percentile(requests, 50),
+            'requestP95': _percentile(requests, 95),
+            'requestP99': _percentile(requests, 99),
+            'peakMemory': peak}
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+################################################################################
+# runBenchmarks() starts the stand-in server and times each library function.
+# only is an optional set of benchmark groups:
+# auth, list, metadata, content, bulk
+# Single calls run `repeat` times. Listings, batches and whole bulk downloads
+# run batchRepeat times; their per-request percentiles cover every request
+# inside those runs.
+# Returns the list of results from measure().
+
+def runBenchmarks(objects=1000, payload=32768, latency=0.0, errors=0.0, zipSize=100, zipDelay=0.5, repeat=20, workers=8, only=None, batchRepeat=5):
+    results = []
+    workdir = tempfile.mkdtemp(prefix='skunkworksBench-')
+    groups = set(only or ('auth', 'list', 'metadata', 'content', 'bulk'))
+    sample = [_objectId(i) for i in range(min(objects, repeat * workers))]
+    registry = getRegistry()
+
+    try:
+        with MockCSSServer(objects, payload, latency, errors, zipSize, zipDelay) as server:
+            token = 'mock-token'
+            apiUrl = server.baseUrl + '/storage/us-west/v3'
+            objectsUrl = apiUrl + '/objects'
+            bulkUrl = apiUrl + '/bulk/download'
+            # The getCSS_* functions run on the shared session and limiter, as
+            # they would in a script.
+
+            if 'auth' in groups:
+                credentials = os.path.join(workdir, 'creds.json')
+                with open(credentials, 'w') as f:
+                    json.dump({'key': 'mock', 'secret': 'mock'}, f)
+                vccCredentials = os.path.join(workdir, 'vccchat.creds')
+                with open(vccCredentials, 'w') as f:
+                    json.dump({'username': 'mock', 'ActionRequestToken': 'mock', 'apigeeAPI': 'mock'}, f)
+                authendpoint = server.baseUrl + '/oauth/v2/token'
+                vccEndpoint = server.baseUrl + '/vcc/chat/v1/authorize'
+                results.append(measure('clientCredentialsAuthorize',
+                                       lambda: clientCredentialsAuthorize(credentials, authendpoint) and None, repeat, 1, registry))
+                results.append(measure('vccJWTauthorize',
+                                       lambda: vccJWTauthorize(vccCredentials, vccEndpoint) and None, repeat, 1, registry))
+                provider = TokenProvider(credentials=credentials, authendpoint=authendpoint)
+                results.append(measure('TokenProvider.getToken',
+                                       lambda: provider.getToken() and None, repeat, 1, registry))
+
+            if 'list' in groups:
+                results.append(measure('getCSS_ObjectsList',
+                                       lambda: len(skunkworksCSS.getCSS_ObjectsList(token, objectsUrl)) and None, batchRepeat, objects, registry))
+                results.append(measure('getCSS_ObjectsList workers=' + str(workers),
+                                       lambda: len(skunkworksCSS.getCSS_ObjectsList(token, objectsUrl, workers=workers)) and None, batchRepeat, objects, registry))
+                results.append(measure('saveCSS_ObjectsList',
+                                       lambda: skunkworksCSS.saveCSS_ObjectsList(token, os.path.join(workdir, 'objects.jsonl'), objectsUrl) and None, batchRepeat, objects, registry))
+
+            if 'metadata' in groups:
+                ids = itertools.cycle(sample)
+                results.append(measure('getCSS_ObjectMetaData',
+                                       lambda: skunkworksCSS.getCSS_ObjectMetaData(token, next(ids), objectsUrl) and None, repeat, 1, registry))
+                results.append(measure('getCSS_ObjectsMetaData workers=' + str(workers),
+                                       lambda: skunkworksCSS.getCSS_ObjectsMetaData(token, sample, workers, objectsUrl) and None, batchRepeat, len(sample), registry))
+
+            if 'content' in groups:
+                ids = itertools.cycle(sample)
+                results.append(measure('getCSS_ObjectContent',
+                                       lambda: skunkworksCSS.getCSS_ObjectContent(token, next(ids), os.path.join(workdir, 'object.dat'), requestUrl=objectsUrl), repeat, 1, registry))
+                directory = os.path.join(workdir, 'objects')
+                results.append(measure('getCSS_Objects workers=' + str(workers),
+                                       lambda: sum(item['size'] for item in skunkworksCSS.getCSS_Objects(token, sample, directory, workers, requestUrl=objectsUrl)), batchRepeat, len(sample), registry))
+
+            if 'bulk' in groups:
+                bulkIds = [_objectId(i) for i in range(min(objects, zipSize * 4))]
+                results.append(measure('initiateCSS_BulkDownload',
+                                       lambda: skunkworksCSS.initiateCSS_BulkDownload(token, bulkIds[:zipSize], bulkUrl + '/start') and None, repeat, 1, registry))
+                results.append(measure('getCSS_BulkStatus',
+                                       lambda: skunkworksCSS.getCSS_BulkStatus(token, bulkUrl + '/status') and None, repeat, 1, registry))
+                zipName = skunkworksCSS.initiateCSS_BulkDownload(token, bulkIds[:zipSize], bulkUrl + '/start').json()[0]['zipName']
+                time.sleep(zipDelay)
+                results.append(measure('getCSS_zipStatus',
+                                       lambda: skunkworksCSS.getCSS_zipStatus(token, zipName, bulkUrl + '/status') and None, repeat, 1, registry))
+                results.append(measure('getCSS_BulkContent',
+                                       lambda: skunkworksCSS.getCSS_BulkContent(token, zipName, os.path.join(workdir, 'bulk.zip'), bulkUrl), repeat, 1, registry))
+                results.append(measure('extractCSS_BulkContent',
+                                       lambda: sum(item['size'] for item in skunkworksCSS.extractCSS_BulkContent(token, zipName, os.path.join(workdir, 'extract'), requestUrl=bulkUrl)), repeat, 1, registry))
+                results.append(measure('clearCSS_BulkRequests',
+                                       lambda: skunkworksCSS.clearCSS_BulkRequests(token, bulkUrl + '/clear') and None, repeat, 1, registry))
+                results.append(measure('downloadCSS_Bulk',
+                                       lambda: sum(item['size'] for item in skunkworksCSS.downloadCSS_Bulk(token, bulkIds, os.path.join(workdir, 'bulk'), workers=workers, pollInterval=0.05, baseUrl=server.baseUrl + '/storage')['zips']), batchRepeat, len(bulkIds), registry))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+################################################################################
+# formatResults() lays the results out as a table for the terminal.
+
+def formatResults(results):
+    lines = ['%-40s %8s %10s %10s %9s %9s %9s %8s %9s %9s %9s %10s' % ('benchmark', 'ops', 'ops/s', 'MB/s', 'p50 ms', 'p95 ms', 'p99 ms',
+                                                                    'requests', 'req p50', 'req p95', 'req p99', 'peak KB')]
+    for item in results:
+        lines.append('%-40s %8d %10.1f %10.2f %9.2f %9.2f %9.2f %8d %9.2f %9.2f %9.2f %10d' % (
+            item['name'], item['operations'], item['opsPerSecond'], item['bytesPerSecond'] / 1e6,
+            item['p50'] * 1000, item['p95'] * 1000, item['p99'] * 1000,
+            item['requests'], item['requestP50'] * 1000, item['requestP95'] * 1000, item['requestP99'] * 1000, item['peakMemory'] // 1024))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark skunkworksCSS and skunkworksAuth against a local stand-in CSS server.')
+    parser.add_argument('--objects', type=int, default=1000, help='objects the server lists')
+    parser.add_argument('--payload', type=int, default=32768, help='bytes of content per object')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--errors', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--zip-size', type=int, default=100, help='object ids per bulk zip')
+    parser.add_argument('--zip-delay', type=float, default=0.5, help='seconds before a bulk zip is DONE')
+    parser.add_argument('--repeat', type=int, default=20, help='repetitions of each single-call benchmark')
+    parser.add_argument('--batch-repeat', type=int, default=5, help='repetitions of each listing, batch and bulk benchmark')
+    parser.add_argument('--workers', type=int, default=8, help='concurrency for the parallel benchmarks')
+    parser.add_argument('--only', default='', help='comma separated groups: auth,list,metadata,content,bulk')
+    parser.add_argument('--json', default='', help='also write the results to this json file')
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.objects, args.payload, args.latency, args.errors, args.zip_size, args.zip_delay,
+                            args.repeat, args.workers, [group for group in args.only.split(',') if group], args.batch_repeat)
+    print(formatResults(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -3,14 +3,1361 @@
 
 # All API calls require a bearer token. Use the clientCredentialsAuthorize()
 # function in the skunkworksAuth library to generate a bearer token.
+# Long running jobs should pass a skunkworksAuth.TokenProvider instead of the
+# token string, so the token is renewed before it expires.
+
+# Every call goes through a CSSClient object. The client holds one pooled
+# requests.Session, so repeated calls reuse the same keep-alive connections to
+# the API instead of paying for a new TCP+TLS handshake each time.
+# ex: client = CSSClient(token, region='us-west', poolSize=20)
+#     objects = client.getObjectsList(filter='type==callcenterrecording')
+#     client.close()
+
+# The getCSS_*() functions below are thin wrappers kept for existing scripts.
+# They share a module level session, so they get connection reuse for free.
+
+# Requests, retries, bytes transferred and bulk polling time are recorded in
+# skunkworksMetrics. Progress messages go to the 'skunkworksCSS' logger.
 
 import base64
+import hashlib
+import io
 import json
+import logging
+import os
+import re
 import requests
+from requests.adapters import HTTPAdapter
 from requests_oauth2 import OAuth2BearerToken
+import threading
 import time
 import random
 
+import skunkworksMetrics
+
+CSS_BASE_URL = 'https://api.8x8.com/storage'
+CSS_DEFAULT_REGION = 'us-west'
+# (connect, read) timeout in seconds for every request a CSSClient makes.
+CSS_TIMEOUT = (10.0, 60.0)
+
+log = logging.getLogger('skunkworksCSS')
+
+
+
+
+################################################################################
+# The shared session backs the getCSS_*() wrapper functions. It is created the
+# first time it is needed and kept for the life of the process. Wrappers that
+# run `workers` requests at once ask for a pool at least that large, and the
+# pool grows to fit, so no connection is thrown away and opened again.
+
+_sharedSession = None
+_sharedPoolSize = 0
+_sharedSessionLock = threading.Lock()
+
+def _buildSession(poolSize=10, keepAlive=True):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keepAlive:
+        session.headers['Connection'] = 'close'
+    return session
+
+def _getSharedSession(poolSize=10):
+    global _sharedSession, _sharedPoolSize
+    with _sharedSessionLock:
+        if _sharedSession is None:
+            _sharedSession = _buildSession(poolSize)
+            _sharedPoolSize = poolSize
+        elif poolSize > _sharedPoolSize:
+            adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+            _sharedSession.mount('https://', adapter)
+            _sharedSession.mount('http://', adapter)
+            _sharedPoolSize = poolSize
+    return _sharedSession
+
+
+################################################################################
+# RateLimiter is a token bucket shared by every request a client makes.
+# rate is the starting number of requests per second and burst the bucket size.
+# The rate adapts to the API. A 429 or 5xx halves it, down to minRate. A
+# Retry-After on a 429 pauses every caller until it has passed. A successful
+# request raises it by `increase`, up to maxRate when one is given, but only
+# if a caller had to wait for the bucket since the last raise. The rate
+# therefore only grows while the limiter is what holds requests back, and it
+# never runs far ahead of the rate requests are actually made at, so a
+# throttle always slows things down.
+# The defaults start high, so the limiter stays out of the way until the API
+# pushes back, and 429s and Retry-After set the pace.
+# acquire() blocks the calling thread. Asyncio code should await
+# acquireAsync() instead, so the event loop keeps running while it waits.
+# The bucket is guarded by a lock, so one limiter can serve many threads,
+# tasks and clients at once.
+# ex: limiter = RateLimiter(rate=20, burst=40, maxRate=100)
+#     client = CSSClient(token, rateLimiter=limiter)
+# A limiter can also meter bytes: acquire(len(chunk)) on a limiter whose rate
+# is in bytes per second (see CSSClient's bandwidthLimiter).
+
+class RateLimiter:
+    def __init__(self, rate=1000.0, burst=1000, minRate=0.5, maxRate=None, increase=1.0):
+        self.rate = float(rate)
+        self.burst = burst
+        self.minRate = minRate
+        self.maxRate = maxRate
+        self.increase = increase
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blockedUntil = 0.0
+        self.waited = False
+        self._lock = threading.Lock()
+
+    # Takes `tokens` tokens if they are available and returns 0, otherwise
+    # returns the number of seconds to wait before trying again. A request for
+    # more than burst tokens goes through once the bucket is full, leaving it
+    # in debt, so a limiter in bytes per second can meter large chunks.
+    def _reserve(self, tokens=1):
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blockedUntil:
+                return self.blockedUntil - now
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            needed = min(tokens, self.burst)
+            if self.tokens >= needed:
+                self.tokens = self.tokens - tokens
+                return 0
+            self.waited = True
+            return (needed - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        wait = self._reserve(tokens)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self._reserve(tokens)
+
+    async def acquireAsync(self, tokens=1):
+        import asyncio
+        wait = self._reserve(tokens)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self._reserve(tokens)
+
+    def success(self):
+        with self._lock:
+            if not self.waited:
+                return
+            self.waited = False
+            self.rate = self.rate + self.increase
+            if self.maxRate is not None:
+                self.rate = min(self.maxRate, self.rate)
+
+    def throttle(self, retryAfter=None):
+        with self._lock:
+            self.rate = max(self.minRate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            if retryAfter:
+                self.blockedUntil = max(self.blockedUntil, time.monotonic() + retryAfter)
+
+_sharedRateLimiter = None
+
+def _getSharedRateLimiter():
+    global _sharedRateLimiter
+    with _sharedSessionLock:
+        if _sharedRateLimiter is None:
+            _sharedRateLimiter = RateLimiter()
+    return _sharedRateLimiter
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+# Whether a failed request can safely be sent again. A POST such as
+# /bulk/download/start may already have created its job when a gateway answers
+# 500, 502 or 504, so non-idempotent requests are only retried when the server
+# clearly turned them away: 429, or 503 with a Retry-After.
+def _shouldRetry(method, response):
+    if response.status_code not in RETRY_STATUS_CODES:
+        return False
+    if method.upper() in IDEMPOTENT_METHODS:
+        return True
+    return response.status_code == 429 or (response.status_code == 503 and _retryAfter(response) is not None)
+
+# Retry-After is either a number of seconds or an HTTP date.
+def _retryAfter(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+################################################################################
+# Sharded listing helpers, see CSSClient.iterObjectsSharded().
+# CSS_WINDOW_FILTER is the filter clause for one createdTime window, and
+# CSS_TIME_FORMAT how window bounds are written into it. Terms are joined with
+# ',' as in any other CSS filter, where every term must match
+# (ex: 'type==callrecording,name==+1').
+
+CSS_WINDOW_FILTER = 'createdTime=ge={start},createdTime=lt={end}'
+CSS_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+def _epochSeconds(value):
+    import calendar
+    import datetime
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            return calendar.timegm(value.timetuple())
+        return value.timestamp()
+    return float(value)
+
+# Runs in a worker process, so it builds its own client and session. auth is
+# a token string, or a dict of TokenProvider arguments when the caller had a
+# provider; the worker then builds its own provider, so it can refresh the
+# token and recover from a 401 on a long backfill. Give the provider a
+# cacheFile to have the processes share one token.
+def _listObjectsWindow(job):
+    auth, region, baseUrl, filter, limit, sortField, sortDirection, workers = job
+    if isinstance(auth, dict):
+        from skunkworksAuth import TokenProvider
+        auth = TokenProvider(**auth)
+    with CSSClient(auth, region=region, baseUrl=baseUrl) as client:
+        return client.getObjectsList(filter=filter, limit=limit, sortField=sortField, sortDirection=sortDirection, workers=workers)
+
+
+################################################################################
+# planCSS_BulkJobs() splits a listing into bulk download jobs of similar size.
+# objects is a list of metadata dicts (ids without a size count as 0 bytes).
+# The number of jobs is the fewest that keeps each one near targetBytes and
+# within maxIds. Objects are then placed largest first into the job with the
+# least bytes so far that still has room for another id, which keeps the zips
+# evenly sized. An object bigger than targetBytes still goes in one job.
+# Returns a list of jobs: [{'ids': [...], 'bytes': total storedBytes}]
+# ex: jobs = planCSS_BulkJobs(objectList, targetBytes=512 * 1024 * 1024, maxIds=500)
+
+BULK_TARGET_BYTES = 1024 * 1024 * 1024
+BULK_MAX_IDS = 1000
+
+def planCSS_BulkJobs(objects, targetBytes=BULK_TARGET_BYTES, maxIds=BULK_MAX_IDS):
+    import heapq
+    sized = [(int(obj.get('storedBytes') or 0) if isinstance(obj, dict) else 0, _objectIdOf(obj)) for obj in objects]
+    if not sized:
+        return []
+    total = sum(size for size, objectId in sized)
+    count = max(-(-total // targetBytes), -(-len(sized) // maxIds), 1)
+    jobs = [{'ids': [], 'bytes': 0} for i in range(count)]
+    heap = [(0, i) for i in range(count)]
+    sized.sort(key=lambda item: item[0], reverse=True)
+    for size, objectId in sized:
+        if not heap:
+            heap = [(0, len(jobs))]
+            jobs.append({'ids': [], 'bytes': 0})
+        load, i = heapq.heappop(heap)
+        jobs[i]['ids'].append(objectId)
+        jobs[i]['bytes'] = load + size
+        if len(jobs[i]['ids']) < maxIds:
+            heapq.heappush(heap, (load + size, i))
+    return [job for job in jobs if job['ids']]
+
+def _objectIdOf(obj):
+    if isinstance(obj, dict):
+        return obj['id']
+    return obj
+
+
+################################################################################
+# _sinkWriter() returns a function that hands one buffer of content to sink:
+# - a subprocess.Popen (ex: an audio transcoder started with stdin=PIPE):
+#   buffers are written to its stdin. The caller closes stdin and waits.
+# - a writable file-like object (open file, BytesIO, socket.makefile('wb')):
+#   buffers are passed to its write()
+# - any other callable: called with each buffer
+# Buffers are passed on exactly as requests hands them over, without copying.
+
+def _sinkWriter(sink):
+    if getattr(sink, 'stdin', None) is not None and hasattr(sink, 'poll'):
+        return sink.stdin.write
+    if hasattr(sink, 'write'):
+        return sink.write
+    if callable(sink):
+        return sink
+    raise TypeError('sink must be a file-like object, a subprocess.Popen, or a callable')
+
+
+################################################################################
+# CSS metadata reports a checksum and checksumType for every object.
+# _newHasher() returns a hashlib object for checksumType (ex: MD5, SHA-256),
+# or None when the type is not one hashlib knows, in which case the content is
+# not verified. The checksum may be hex or base64 encoded; both are accepted.
+
+def _newHasher(checksumType):
+    if not checksumType:
+        return None
+    try:
+        return hashlib.new(checksumType.replace('-', '').replace('_', '').lower())
+    except ValueError:
+        return None
+
+def _checksumMatches(hasher, checksum):
+    digest = hasher.digest()
+    return checksum.lower() == digest.hex() or checksum == base64.b64encode(digest).decode('ascii')
+
+# Parses a Content-Range header into (start, total). 'bytes 100-199/300' gives
+# (100, 300) and 'bytes */300' gives (None, 300). Anything unreadable gives
+# (None, None).
+def _contentRange(response):
+    match = re.match(r'bytes\s+(?:(\d+)-\d+|\*)/(\d+|\*)', response.headers.get('Content-Range', ''))
+    if not match:
+        return None, None
+    start = int(match.group(1)) if match.group(1) is not None else None
+    total = int(match.group(2)) if match.group(2) != '*' else None
+    return start, total
+
+
+################################################################################
+# MetadataCache is a size-bounded LRU cache of object metadata, with entries
+# expiring ttl seconds after they were fetched. It is safe to share between
+# threads and between clients. hits and misses count lookups, and save()/load()
+# keep the cache between runs as a json file.
+# ex: cache = MetadataCache(maxSize=50000, ttl=3600, filename='metadata.json')
+#     client = CSSClient(token, metadataCache=cache)
+#     ...
+#     cache.save()
+
+class MetadataCache:
+    def __init__(self, maxSize=10000, ttl=3600, filename=None):
+        from collections import OrderedDict
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if filename and os.path.exists(filename):
+            self.load(filename)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, objectId):
+        with self._lock:
+            entry = self._entries.get(objectId)
+            if entry is None or entry[0] + self.ttl < time.time():
+                if entry is not None:
+                    del self._entries[objectId]
+                self.misses = self.misses + 1
+                return None
+            self._entries.move_to_end(objectId)
+            self.hits = self.hits + 1
+            return entry[1]
+
+    def put(self, objectId, metadata, fetchedAt=None):
+        with self._lock:
+            self._entries[objectId] = (fetchedAt or time.time(), metadata)
+            self._entries.move_to_end(objectId)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def save(self, filename=None):
+        filename = filename or self.filename
+        with self._lock:
+            entries = [[objectId, fetchedAt, metadata] for objectId, (fetchedAt, metadata) in self._entries.items()]
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmpfile, filename)
+
+    def load(self, filename=None):
+        filename = filename or self.filename
+        with open(filename) as f:
+            entries = json.load(f)
+        for objectId, fetchedAt, metadata in entries:
+            if fetchedAt + self.ttl >= time.time():
+                self.put(objectId, metadata, fetchedAt)
+
+
+################################################################################
+# CSSClient wraps every Cloud Storage Service operation around one pooled
+# session.
+#
+# accessToken - bearer token from clientCredentialsAuthorize()['access_token'],
+#               or a skunkworksAuth.TokenProvider that renews it as needed
+# region      - storage region, used to build the API url (default us-west)
+# baseUrl     - storage service root, ex: https://api.8x8.com/storage
+# poolSize    - number of keep-alive connections kept open to the API
+# keepAlive   - set False to close the connection after every request
+# session     - optional existing requests.Session to share between clients.
+#               A client never closes a session it did not create.
+# metadataCache - optional MetadataCache used by the metadata lookups
+# rateLimiter - RateLimiter applied to every request. Clients share one
+#               module level limiter unless given their own.
+# retries     - how many times a 429 or 5xx response is retried
+# backoff     - first retry delay in seconds when there is no Retry-After
+# metrics     - skunkworksMetrics.MetricsRegistry to record requests in.
+#               Defaults to the process wide registry.
+# transferSlots - optional threading.Semaphore capping concurrent content
+#               transfers. Share one between clients for a global budget.
+# bandwidthLimiter - optional RateLimiter in bytes per second that content
+#               transfers draw from. Share one for a global bandwidth budget.
+# timeout     - (connect, read) seconds passed with every request. The read
+#               timeout is the longest wait for the next bytes, so a stalled
+#               download raises requests.Timeout and is resumed. None waits
+#               forever.
+#
+# Each method takes an optional requestUrl, which overrides the url built
+# from baseUrl and region, the same way the getCSS_*() functions always have.
+
+class CSSClient:
+    def __init__(self, accessToken, region=CSS_DEFAULT_REGION, baseUrl=CSS_BASE_URL, poolSize=10, keepAlive=True, session=None, metadataCache=None, rateLimiter=None, retries=5, backoff=1.0, metrics=None, transferSlots=None, bandwidthLimiter=None, timeout=CSS_TIMEOUT):
+        self.accessToken = accessToken
+        self.timeout = timeout
+        self.transferSlots = transferSlots
+        self.bandwidthLimiter = bandwidthLimiter
+        self.metrics = metrics or skunkworksMetrics.getRegistry()
+        self.metadataCache = metadataCache
+        self.rateLimiter = rateLimiter or _getSharedRateLimiter()
+        self.retries = retries
+        self.backoff = backoff
+        self.region = region
+        self.baseUrl = baseUrl
+        self.apiUrl = baseUrl + '/' + region + '/v3'
+        self.poolSize = poolSize
+        self.keepAlive = keepAlive
+        self._ownsSession = session is None
+        if session is None:
+            session = _buildSession(poolSize, keepAlive)
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._ownsSession:
+            self.session.close()
+
+    # accessToken may be a token string or a skunkworksAuth.TokenProvider.
+    # With a provider, a 401 response drops the cached token and the request
+    # is sent once more with a fresh one.
+    def _token(self):
+        if hasattr(self.accessToken, 'getToken'):
+            return self.accessToken.getToken()
+        return self.accessToken
+
+    # Every request waits for the rate limiter first. 429 and 5xx responses
+    # slow the limiter down and are retried up to self.retries times, after
+    # Retry-After when the server sends one, or exponential backoff otherwise.
+    # POSTs are only retried on 429, or 503 with Retry-After (see _shouldRetry()).
+    def _request(self, method, url, **kwargs):
+        endpoint = skunkworksMetrics.endpointOf(url)
+        attempt = 0
+        while True:
+            self.rateLimiter.acquire()
+            token = self._token()
+            response = self._send(method, url, endpoint, token, **kwargs)
+            if response.status_code == 401 and hasattr(self.accessToken, 'invalidate'):
+                response.close()
+                self.metrics.retry('css', endpoint, 'unauthorized')
+                # Only the rejected token is dropped. If another request has
+                # already replaced it, the retry simply uses the new one.
+                self.accessToken.invalidate(token)
+                self.rateLimiter.acquire()
+                response = self._send(method, url, endpoint, self._token(), **kwargs)
+            if not _shouldRetry(method, response) or attempt >= self.retries:
+                if response.status_code < 400:
+                    self.rateLimiter.success()
+                elif response.status_code in RETRY_STATUS_CODES:
+                    self.rateLimiter.throttle(_retryAfter(response) if response.status_code == 429 else None)
+                return response
+            retryAfter = _retryAfter(response)
+            self.rateLimiter.throttle(retryAfter if response.status_code == 429 else None)
+            response.close()
+            if retryAfter is None:
+                retryAfter = self.backoff * (2 ** attempt)
+            self.metrics.retry('css', endpoint, response.status_code)
+            log.info('%s %s returned %d, retrying in %.1fs', method, endpoint, response.status_code, retryAfter)
+            time.sleep(retryAfter)
+            attempt = attempt + 1
+
+    def _send(self, method, url, endpoint, token, **kwargs):
+        started = time.time()
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session.request(method, url, auth=OAuth2BearerToken(token), **kwargs)
+        bytesIn = 0
+        if not kwargs.get('stream'):
+            bytesIn = len(response.content)
+        self.metrics.request('css', endpoint, method, response.status_code, time.time() - started,
+                             bytesIn, skunkworksMetrics.bodySize(response.request))
+        return response
+
+    ############################################################################
+    # See getCSS_ObjectsList() below for filter and sort options.
+    # workers > 1 fetches that many pages at once. Page offsets are predictable
+    # (pageKey, pageKey+limit, ...), so pages are requested ahead of time and
+    # handed back in server sort order. No new pages are requested once a
+    # response reports lastPage.
+
+    def getObjectsList(self, filter='', pageKey=0, limit=100, sortField='createdTime', sortDirection='DESC', requestUrl=None, workers=1):
+        return list(self.iterObjectsList(filter, pageKey, limit, sortField, sortDirection, requestUrl, workers))
+
+    ############################################################################
+    # Same listing as getObjectsList(), but yields objects as each page arrives
+    # instead of building one list. Only the pages in flight are held in memory.
+    # pages=True yields each page's "content" list instead of single objects.
+
+    def iterObjectsList(self, filter='', pageKey=0, limit=100, sortField='createdTime', sortDirection='DESC', requestUrl=None, workers=1, pages=False):
+        for page in self._iterObjectsPages(filter, pageKey, limit, sortField, sortDirection, requestUrl, workers):
+            if pages:
+                yield page["content"]
+            else:
+                for item in page["content"]:
+                    yield item
+
+    ############################################################################
+    # Writes the listing to filename as JSON Lines, one object per line, and
+    # returns the number of objects written.
+
+    def saveObjectsList(self, filename, filter='', pageKey=0, limit=100, sortField='createdTime', sortDirection='DESC', requestUrl=None, workers=1):
+        count = 0
+        with open(filename, 'w') as outfile:
+            for item in self.iterObjectsList(filter, pageKey, limit, sortField, sortDirection, requestUrl, workers):
+                outfile.write(json.dumps(item) + '\n')
+                count = count + 1
+        return count
+
+    ############################################################################
+    # Lists objects created between start and end by splitting the range into
+    # `shards` createdTime windows and listing each window in its own process.
+    # Windows are handed back in sortDirection order and objects are
+    # de-duplicated by id, so with sortField='createdTime' the result is in
+    # the same order as a single listing.
+    # start and end are datetimes (naive ones are taken as UTC) or epoch seconds.
+    # windowFilter is filled in with the window bounds formatted by timeFormat
+    # and added to filter as more ',' terms, so each window lists only the
+    # objects that match filter and fall inside it. Change both if the tenant
+    # expects a different filter syntax.
+    # Each process has its own connection pool and rate limiter. A token string
+    # is handed to the workers as it is. A TokenProvider is handed over as its
+    # settings (authorize, credentials, authendpoint, cacheFile, refreshMargin)
+    # and rebuilt in each worker, which keeps the token fresh.
+
+    def iterObjectsSharded(self, start, end, shards=16, processes=None, filter='', limit=100, sortField='createdTime', sortDirection='DESC', workers=1, windowFilter=None, timeFormat=None):
+        from concurrent.futures import ProcessPoolExecutor
+        windowFilter = windowFilter or CSS_WINDOW_FILTER
+        timeFormat = timeFormat or CSS_TIME_FORMAT
+        start = _epochSeconds(start)
+        end = _epochSeconds(end)
+        bounds = [int(start + (end - start) * i / shards) for i in range(shards)] + [int(end)]
+        windows = [(low, high) for low, high in zip(bounds[:-1], bounds[1:]) if high > low]
+        if sortDirection == 'DESC':
+            windows.reverse()
+
+        auth = self.accessToken
+        if hasattr(auth, 'getToken'):
+            auth = dict(authorize=auth.authorize, credentials=auth.credentials, authendpoint=auth.authendpoint,
+                        cacheFile=auth.cacheFile, refreshMargin=auth.refreshMargin)
+        jobs = []
+        for low, high in windows:
+            clause = windowFilter.format(start=time.strftime(timeFormat, time.gmtime(low)), end=time.strftime(timeFormat, time.gmtime(high)))
+            if filter:
+                clause = filter + ',' + clause
+            jobs.append((auth, self.region, self.baseUrl, clause, limit, sortField, sortDirection, workers))
+
+        seen = set()
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            for items in pool.map(_listObjectsWindow, jobs):
+                for item in items:
+                    if item['id'] not in seen:
+                        seen.add(item['id'])
+                        yield item
+
+    def getObjectsSharded(self, start, end, shards=16, processes=None, filter='', limit=100, sortField='createdTime', sortDirection='DESC', workers=1, windowFilter=None, timeFormat=None):
+        return list(self.iterObjectsSharded(start, end, shards, processes, filter, limit, sortField, sortDirection, workers, windowFilter, timeFormat))
+
+    def _getObjectsPage(self, requestUrl, params, pageKey):
+        params = dict(params, pageKey=pageKey)
+        r = self._request('GET', requestUrl, params=params)
+        r.raise_for_status()
+        return r.json()
+
+    def _iterObjectsPages(self, filter, pageKey, limit, sortField, sortDirection, requestUrl, workers):
+        from concurrent.futures import ThreadPoolExecutor
+        if requestUrl is None:
+            requestUrl = self.apiUrl + '/objects'
+        params = {"Content-Type": "application/json",
+                  'Accept': 'application/json',
+                  'filter': filter,
+                  'limit': limit,
+                  'sortField': sortField,
+                  'sortDirection': sortDirection}
+
+        if workers <= 1:
+            while True:
+                page = self._getObjectsPage(requestUrl, params, pageKey)
+                yield page
+                if page['lastPage']:
+                    return
+                pageKey = pageKey + limit
+
+        # Keep up to `workers` pages in flight, always handing back the lowest
+        # outstanding offset first. lastKey is the offset of the last page,
+        # once any response has told us where it is.
+        pool = ThreadPoolExecutor(max_workers=workers)
+        pending = {}
+        nextKey = pageKey
+        lastKey = None
+        try:
+            while lastKey is None or pageKey <= lastKey:
+                while lastKey is None and len(pending) < workers:
+                    pending[nextKey] = pool.submit(self._getObjectsPage, requestUrl, params, nextKey)
+                    nextKey = nextKey + limit
+                page = pending.pop(pageKey).result()
+                if page['lastPage']:
+                    lastKey = pageKey
+                for key, future in list(pending.items()):
+                    if future.done() and not future.exception() and future.result()['lastPage']:
+                        if lastKey is None or key < lastKey:
+                            lastKey = key
+                yield page
+                pageKey = pageKey + limit
+        finally:
+            for future in pending.values():
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    ############################################################################
+    # Returns the metadata json for a single object id.
+    # Answers from metadataCache when the client has one and the entry is fresh.
+
+    def getObjectMetaData(self, objectId, requestUrl=None):
+        if self.metadataCache is not None:
+            metadata = self.metadataCache.get(objectId)
+            if metadata is not None:
+                return metadata
+        if requestUrl is None:
+            requestUrl = self.apiUrl + '/objects'
+        metadataUrl = requestUrl + '/' + objectId + '/metadata'
+        response = self._request('GET', metadataUrl)
+        response.raise_for_status()
+        metadata = response.json()
+        if self.metadataCache is not None:
+            self.metadataCache.put(objectId, metadata)
+        return metadata
+
+    ############################################################################
+    # Returns {objectId: metadata} for a list of object ids. Ids missing from
+    # the cache are fetched `workers` at a time over the pooled session.
+    # Every lookup runs to completion, even when some fail. Pass a dict as
+    # errors to get {objectId: message} for the failed ids, which are left out
+    # of the result. Without it, the first failure is raised once all lookups
+    # are done (the successes are still kept in the metadataCache, if any).
+
+    def getObjectsMetaData(self, objectIds, workers=8, requestUrl=None, errors=None):
+        from concurrent.futures import ThreadPoolExecutor
+        objectIds = list(dict.fromkeys(objectIds))
+
+        def lookup(objectId):
+            try:
+                return self.getObjectMetaData(objectId, requestUrl), None
+            except Exception as e:
+                return None, e
+
+        results = {}
+        failures = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for objectId, (metadata, error) in zip(objectIds, pool.map(lookup, objectIds)):
+                if error is None:
+                    results[objectId] = metadata
+                else:
+                    failures[objectId] = error
+        if failures and errors is None:
+            raise next(iter(failures.values()))
+        if errors is not None:
+            errors.update((objectId, str(error)) for objectId, error in failures.items())
+        return results
+
+    ############################################################################
+    # Writes the content of an object to filename.
+    # Returns the size of the file in bytes.
+    # The download goes to filename + '.part' and is renamed into place once it
+    # is complete, so filename never holds a partial or error response. A
+    # dropped connection is resumed from the end of the .part file with an HTTP
+    # Range request, up to `retries` times with exponential backoff.
+    # The content is verified against the checksum and checksumType from the
+    # object's metadata while it streams. Pass them when you already have
+    # them; otherwise the metadata is looked up first (through metadataCache,
+    # if the client has one). verify=False skips both the lookup and the
+    # check. A mismatch raises ValueError.
+    # Content is always written as bytes. textMode is kept for compatibility.
+    #
+    # Pass sink to send the content somewhere other than a file (see
+    # _sinkWriter()): a writable file-like object, a subprocess.Popen started
+    # with stdin=PIPE, or a callable that is handed each buffer. Returns the
+    # number of bytes delivered. A dropped connection resumes where the sink
+    # left off, but a checksum mismatch can only be reported after the bytes
+    # were delivered.
+    # chunkSize sets the read size and the size of the buffers handed over.
+
+    def getObjectContent(self, objectId, filename='data.dat', textMode=False, requestUrl=None, presignUrl=False, checksum=None, checksumType=None, retries=5, sink=None, chunkSize=1048576, verify=True):
+        if requestUrl is None:
+            requestUrl = self.apiUrl + '/objects'
+        contentUrl = requestUrl + '/' + objectId + '/content'
+        if verify and not checksum:
+            metadata = self.getObjectMetaData(objectId, requestUrl)
+            checksum = metadata.get('checksum')
+            checksumType = metadata.get('checksumType')
+
+        log.info('Fetching content of %s', objectId)
+        if sink is not None:
+            size = self._streamContent(contentUrl, sink, chunkSize, checksum=checksum, checksumType=checksumType, retries=retries)
+        else:
+            size = self._downloadContent(contentUrl, filename, chunkSize, checksum=checksum, checksumType=checksumType, retries=retries)
+        log.info('Fetched %s: %d bytes', objectId, size)
+        return size
+
+    ############################################################################
+    # Downloads many objects at once into directory.
+    # objects is a list of object ids, or of metadata dicts as returned by
+    # getObjectsList() / getObjectMetaData(). Each object is saved as its id,
+    # plus the extension of its objectName when a metadata dict is given.
+    # workers sets how many downloads run at the same time, and chunkSize is
+    # both the read size from the network and the file write buffer.
+    #
+    # Metadata dicts that carry checksum/checksumType are verified as they
+    # download, and interrupted downloads resume (see getObjectContent()).
+    #
+    # Returns one result per object, in the order given:
+    # {'id': ..., 'filename': ..., 'size': bytes, 'duration': seconds, 'error': None or message}
+    # A failed object does not stop the others.
+
+    def downloadObjects(self, objects, directory='.', workers=8, chunkSize=1048576, requestUrl=None):
+        from concurrent.futures import ThreadPoolExecutor
+        os.makedirs(directory, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda obj: self._fetchObject(obj, directory, chunkSize, requestUrl), objects))
+
+    def _fetchObject(self, obj, directory, chunkSize=1048576, requestUrl=None):
+        if requestUrl is None:
+            requestUrl = self.apiUrl + '/objects'
+        checksum = None
+        checksumType = None
+        if isinstance(obj, dict):
+            objectId = obj['id']
+            extension = os.path.splitext(obj.get('objectName') or '')[1]
+            checksum = obj.get('checksum')
+            checksumType = obj.get('checksumType')
+        else:
+            objectId = obj
+            extension = ''
+        filename = os.path.join(directory, objectId + extension)
+        result = {'id': objectId, 'filename': filename, 'size': -1, 'duration': 0.0, 'error': None}
+        started = time.time()
+        try:
+            contentUrl = requestUrl + '/' + objectId + '/content'
+            result['size'] = self._downloadContent(contentUrl, filename, chunkSize, checksum=checksum, checksumType=checksumType)
+        except Exception as e:
+            result['error'] = str(e)
+        result['duration'] = time.time() - started
+        return result
+
+    ############################################################################
+    # Lists and downloads at the same time. A producer thread walks the listing
+    # (see iterObjectsList()) and puts each object on a queue of at most
+    # queueSize objects. Download workers take objects off the queue as soon as
+    # the first page arrives. When the downloads fall behind, the full queue
+    # pauses the listing, so memory stays bounded however large the tenant is.
+    #
+    # mode='objects' downloads each object on its own, `workers` at a time.
+    # mode='bulk' groups objects into bulk jobs of batchSize ids and runs up to
+    # `workers` bulkDownload() jobs at a time. Bulk requests are cleared at the
+    # end, on the same terms as bulkDownload().
+    # onResult, when given, is called with each object result (mode='objects')
+    # or zip result (mode='bulk') as it completes.
+    #
+    # Returns a summary:
+    # {'listed': n, 'downloaded': n, 'failed': n, 'bytes': n, 'seconds': s,
+    #  'errors': [failed results], 'listError': None or message,
+    #  'callbackErrors': number of onResult calls that raised}
+
+    def pipelineDownload(self, directory='.', filter='', sortField='createdTime', sortDirection='DESC', mode='objects', workers=8, batchSize=100, queueSize=1000, listWorkers=1, chunkSize=1048576, onResult=None):
+        import queue
+        from concurrent.futures import ThreadPoolExecutor
+        if mode not in ('objects', 'bulk'):
+            raise ValueError("mode must be 'objects' or 'bulk'")
+        os.makedirs(directory, exist_ok=True)
+        work = queue.Queue(maxsize=queueSize)
+        done = object()
+        stopped = threading.Event()
+        lock = threading.Lock()
+        ours = set()
+        started = time.time()
+        summary = {'listed': 0, 'downloaded': 0, 'failed': 0, 'bytes': 0, 'seconds': 0.0, 'errors': [], 'listError': None, 'callbackErrors': 0}
+
+        # Puts item on the queue, unless the downloads have stopped taking
+        # from it, so the producer never outlives its consumers.
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    work.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for obj in self.iterObjectsList(filter=filter, sortField=sortField, sortDirection=sortDirection, workers=listWorkers):
+                    if not put(obj):
+                        return
+                    with lock:
+                        summary['listed'] += 1
+            except Exception as e:
+                summary['listError'] = str(e)
+                log.error('Listing failed: %s', e)
+            finally:
+                put(done)
+
+        # Object counts are kept by tally(): per object in mode='objects', and
+        # per bulk job in mode='bulk', since a job's ids are not known zip by zip.
+        # An exception from onResult is logged and counted, never allowed to
+        # stop a download worker.
+        def record(result):
+            with lock:
+                if result['error'] is None:
+                    summary['bytes'] += max(result['size'], 0)
+                else:
+                    summary['errors'].append(result)
+            if onResult is not None:
+                try:
+                    onResult(result)
+                except Exception:
+                    log.exception('onResult callback failed')
+                    with lock:
+                        summary['callbackErrors'] += 1
+
+        def tally(ok, count):
+            with lock:
+                summary['downloaded' if ok else 'failed'] += count
+
+        def consumeObjects():
+            while True:
+                obj = work.get()
+                if obj is done:
+                    work.put(done)
+                    return
+                result = self._fetchObject(obj, directory, chunkSize)
+                record(result)
+                tally(result['error'] is None, 1)
+
+        def runBatch(batch, slots):
+            try:
+                zips = self.bulkDownload(batch, directory, workers=2, clear=False)['zips']
+                for result in zips:
+                    with lock:
+                        ours.add(result['zipName'])
+                    record(result)
+                tally(all(result['error'] is None for result in zips), len(batch))
+            except Exception as e:
+                record({'ids': [_objectIdOf(obj) for obj in batch], 'size': -1, 'error': str(e)})
+                tally(False, len(batch))
+            finally:
+                slots.release()
+
+        producer = threading.Thread(target=produce, name='css-pipeline-list', daemon=True)
+        producer.start()
+        try:
+            if mode == 'objects':
+                consumers = [threading.Thread(target=consumeObjects, name='css-pipeline-download', daemon=True) for i in range(workers)]
+                for consumer in consumers:
+                    consumer.start()
+                for consumer in consumers:
+                    consumer.join()
+            else:
+                # At most `workers` bulk jobs in flight; the batcher waits for a
+                # free slot, which in turn backs up the queue and the listing.
+                slots = threading.Semaphore(workers)
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    batch = []
+                    while True:
+                        obj = work.get()
+                        if obj is not done:
+                            batch.append(obj)
+                        if batch and (len(batch) >= batchSize or obj is done):
+                            slots.acquire()
+                            pool.submit(runBatch, batch, slots)
+                            batch = []
+                        if obj is done:
+                            break
+        finally:
+            stopped.set()
+            producer.join()
+        if mode == 'bulk' and not summary['errors']:
+            onServer = set(item['zipName'] for item in self.getBulkStatus().json())
+            if onServer and onServer <= ours:
+                self.clearBulkRequests()
+        summary['seconds'] = time.time() - started
+        return summary
+
+    # Content transfers hold one of transferSlots, when the client has them,
+    # and draw their bytes from bandwidthLimiter. Both may be shared between
+    # clients to put several of them under one budget.
+    def _downloadContent(self, contentUrl, filename, chunkSize=1048576, checksum=None, checksumType=None, retries=5, backoff=1.0):
+        with self._transferSlot():
+            return self._downloadToFile(contentUrl, filename, chunkSize, checksum, checksumType, retries, backoff)
+
+    def _streamContent(self, contentUrl, sink, chunkSize=1048576, checksum=None, checksumType=None, retries=5, backoff=1.0):
+        with self._transferSlot():
+            return self._streamToSink(contentUrl, sink, chunkSize, checksum, checksumType, retries, backoff)
+
+    def _transferSlot(self):
+        import contextlib
+        if self.transferSlots is None:
+            return contextlib.nullcontext()
+        return self.transferSlots
+
+    def _transferred(self, endpoint, nbytes):
+        self.metrics.transfer('css', endpoint, nbytes)
+        if self.bandwidthLimiter is not None:
+            self.bandwidthLimiter.acquire(nbytes)
+
+    def _downloadToFile(self, contentUrl, filename, chunkSize=1048576, checksum=None, checksumType=None, retries=5, backoff=1.0):
+        endpoint = skunkworksMetrics.endpointOf(contentUrl)
+        partname = filename + '.part'
+        if not (checksum and _newHasher(checksumType)) and os.path.exists(partname):
+            # A .part file left by an earlier run cannot be checked without a
+            # checksum, so it is not trusted.
+            os.remove(partname)
+        attempt = 0
+        resumed = False
+        restarted = False
+        while True:
+            offset = 0
+            if os.path.exists(partname):
+                offset = os.path.getsize(partname)
+            hasher = _newHasher(checksumType) if checksum else None
+            if hasher and offset:
+                with open(partname, 'rb') as partfile:
+                    for chunk in iter(lambda: partfile.read(chunkSize), b''):
+                        hasher.update(chunk)
+
+            headers = {}
+            if offset:
+                headers['Range'] = 'bytes=' + str(offset) + '-'
+            try:
+                response = self._request('GET', contentUrl, params={"Content-Type": "application/json"}, headers=headers, stream = True)
+                try:
+                    # A 416 only means the .part file holds everything when
+                    # the server's total size is exactly what we have, and a
+                    # 206 must start where the .part file ends. Anything else
+                    # means the .part file is stale: drop it and start over.
+                    start, total = _contentRange(response)
+                    if offset and ((response.status_code == 416 and total != offset) or (response.status_code == 206 and start != offset)):
+                        log.info('Partial download of %s does not match the server, starting over', filename)
+                        os.remove(partname)
+                        continue
+                    if offset and response.status_code in (206, 416):
+                        resumed = True
+                    if response.status_code != 416:
+                        response.raise_for_status()
+                        writeMode = 'ab'
+                        if response.status_code != 206:
+                            # The server ignored the Range header, start over.
+                            writeMode = 'wb'
+                            hasher = _newHasher(checksumType) if checksum else None
+                        with open(partname, writeMode, buffering=chunkSize) as outfile:
+                            for chunk in response.iter_content(chunk_size=chunkSize):
+                                outfile.write(chunk)
+                                if hasher:
+                                    hasher.update(chunk)
+                                self._transferred(endpoint, len(chunk))
+                finally:
+                    response.close()
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt >= retries:
+                    raise
+                self.metrics.retry('css', endpoint, 'connection')
+                log.info('Download of %s interrupted (%s), resuming', filename, e)
+                time.sleep(backoff * (2 ** attempt))
+                attempt = attempt + 1
+                continue
+            if hasher and not _checksumMatches(hasher, checksum):
+                os.remove(partname)
+                if resumed and not restarted:
+                    # The bytes before the resume point may be the bad ones,
+                    # so fetch the whole object once more before giving up.
+                    log.info('Checksum mismatch for resumed download of %s, starting over', filename)
+                    resumed = False
+                    restarted = True
+                    continue
+                raise ValueError('Checksum mismatch for ' + filename + ': expected ' + checksum + ' (' + str(checksumType) + ')')
+            break
+
+        os.replace(partname, filename)
+        return os.path.getsize(filename)
+
+    # Streams content into a sink instead of a file. After a dropped connection
+    # the download resumes with a Range request from the number of bytes
+    # already delivered. If the server ignores Range, the bytes the sink
+    # already has are skipped.
+    def _streamToSink(self, contentUrl, sink, chunkSize=1048576, checksum=None, checksumType=None, retries=5, backoff=1.0):
+        endpoint = skunkworksMetrics.endpointOf(contentUrl)
+        write = _sinkWriter(sink)
+        hasher = _newHasher(checksumType) if checksum else None
+        delivered = 0
+        attempt = 0
+        while True:
+            headers = {}
+            if delivered:
+                headers['Range'] = 'bytes=' + str(delivered) + '-'
+            try:
+                response = self._request('GET', contentUrl, params={"Content-Type": "application/json"}, headers=headers, stream = True)
+                try:
+                    start, total = _contentRange(response)
+                    if response.status_code == 416 and delivered:
+                        if total != delivered:
+                            raise ValueError('Server reports ' + str(total) + ' bytes for ' + contentUrl + ' but ' + str(delivered) + ' were already delivered')
+                        break
+                    response.raise_for_status()
+                    skip = delivered if response.status_code != 206 else 0
+                    if response.status_code == 206 and start != delivered:
+                        raise ValueError('Server resumed ' + contentUrl + ' at byte ' + str(start) + ' instead of ' + str(delivered))
+                    for chunk in response.iter_content(chunk_size=chunkSize):
+                        if skip:
+                            if len(chunk) <= skip:
+                                skip = skip - len(chunk)
+                                continue
+                            chunk = chunk[skip:]
+                            skip = 0
+                        write(chunk)
+                        if hasher:
+                            hasher.update(chunk)
+                        delivered = delivered + len(chunk)
+                        self._transferred(endpoint, len(chunk))
+                finally:
+                    response.close()
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt >= retries:
+                    raise
+                self.metrics.retry('css', endpoint, 'connection')
+                log.info('Stream of %s interrupted after %d bytes (%s), resuming', endpoint, delivered, e)
+                time.sleep(backoff * (2 ** attempt))
+                attempt = attempt + 1
+                continue
+            break
+
+        if hasher and not _checksumMatches(hasher, checksum):
+            raise ValueError('Checksum mismatch for ' + contentUrl + ': expected ' + checksum + ' (' + str(checksumType) + ')')
+        return delivered
+
+    ############################################################################
+    # Starts a bulk download of a list of object ids. Returns the response.
+
+    def initiateBulkDownload(self, ids, requestUrl=None):
+        if requestUrl is None:
+            requestUrl = self.apiUrl + '/bulk/download/start'
+        params = {
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+            }
+        log.info('Initiating bulk download of %d objects', len(ids))
+        response = self._request('POST', requestUrl, params=params, json=ids)
+        response.raise_for_status()
+        return response
+
+    ############################################################################
+    # Reports the status of all bulk download requests. Returns the response.
+
+    def getBulkStatus(self, requestUrl=None):
+        if requestUrl is None:
+            requestUrl = self.apiUrl + '/bulk/download/status'
+        params = {
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+            }
+        response = self._request('GET', requestUrl, params=params)
+        response.raise_for_status()
+        return response
+
+    ############################################################################
+    # Reports the status of a single zip file. Returns the response.
+
+    def getZipStatus(self, zipName, requestUrl=None):
+        if requestUrl is None:
+            requestUrl = self.apiUrl + '/bulk/download/status'
+        contentUrl = requestUrl + '/' + zipName
+        params = {
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+            }
+        response = self._request('GET', contentUrl, params=params)
+        response.raise_for_status()
+        return response
+
+    ############################################################################
+    # Writes the content of a zip file to filename.
+    # Returns the size of the file in bytes.
+    # Like getObjectContent(), the zip is written to filename + '.part',
+    # resumed with HTTP Range after a dropped connection, and renamed into
+    # place when complete. sink and chunkSize work as in getObjectContent().
+
+    def getBulkContent(self, zipName, filename='data.zip', requestUrl=None, retries=5, sink=None, chunkSize=1048576):
+        if requestUrl is None:
+            requestUrl = self.apiUrl + '/bulk/download'
+        contentUrl = requestUrl + '/' + zipName
+
+        log.info('Fetching content of %s', zipName)
+        if sink is not None:
+            size = self._streamContent(contentUrl, sink, chunkSize, retries=retries)
+        else:
+            size = self._downloadContent(contentUrl, filename, chunkSize, retries=retries)
+        log.info('Fetched %s: %d bytes', zipName, size)
+        return size
+
+    ############################################################################
+    # Extracts the members of a zip straight into directory, or hands each one
+    # to callback(member, fileobj, objectId), without saving the archive first.
+    # A zip's index sits at the end of the file, so the archive is read in
+    # place with HTTP Range requests of blockSize bytes. If the server does not
+    # honour Range, the zip is streamed into a SpooledTemporaryFile that stays
+    # in memory up to spoolSize bytes and only spills to a temp file beyond it.
+    #
+    # objects is an optional list of object ids or metadata dicts from the
+    # listing. Members are matched to them by id or by objectName so they can
+    # be recorded against the listing.
+    #
+    # Returns one result per member:
+    # {'member': name in zip, 'objectId': id or None, 'filename': path or None, 'size': bytes}
+
+    def extractBulkContent(self, zipName, directory=None, callback=None, objects=None, requestUrl=None, blockSize=1048576, spoolSize=67108864):
+        import shutil
+        import tempfile
+        import zipfile
+        if requestUrl is None:
+            requestUrl = self.apiUrl + '/bulk/download'
+        contentUrl = requestUrl + '/' + zipName
+
+        byName = {}
+        for obj in objects or []:
+            if isinstance(obj, dict):
+                byName[obj['id']] = obj['id']
+                if obj.get('objectName'):
+                    byName[obj['objectName']] = obj['id']
+            else:
+                byName[obj] = obj
+
+        # Probe with a one byte Range request. If the server answers 206 with
+        # the size of the zip, it is read in place. Otherwise it is spooled,
+        # asking again without a Range when the 206 gave no size.
+        endpoint = skunkworksMetrics.endpointOf(contentUrl)
+        with self._transferSlot():
+            response = self._request('GET', contentUrl, params={"Content-Type": "application/json"}, headers={'Range': 'bytes=0-0'}, stream = True)
+            response.raise_for_status()
+            start, total = _contentRange(response) if response.status_code == 206 else (None, None)
+            if start == 0 and total is not None:
+                response.close()
+                archive = _HTTPRangeFile(self, contentUrl, total, blockSize)
+            else:
+                if response.status_code == 206:
+                    response.close()
+                    response = self._request('GET', contentUrl, params={"Content-Type": "application/json"}, stream = True)
+                    response.raise_for_status()
+                archive = tempfile.SpooledTemporaryFile(max_size=spoolSize)
+                try:
+                    for chunk in response.iter_content(chunk_size=blockSize):
+                        archive.write(chunk)
+                        self._transferred(endpoint, len(chunk))
+                finally:
+                    response.close()
+                archive.seek(0)
+
+        results = []
+        try:
+            with zipfile.ZipFile(archive) as zf:
+                members = sorted(zf.infolist(), key=lambda info: info.header_offset)
+                for info in members:
+                    if info.is_dir():
+                        continue
+                    baseName = os.path.basename(info.filename)
+                    stem = os.path.splitext(baseName)[0]
+                    objectId = byName.get(info.filename) or byName.get(baseName) or byName.get(stem)
+                    result = {'member': info.filename, 'objectId': objectId, 'filename': None, 'size': info.file_size}
+                    with zf.open(info) as member:
+                        if callback is not None:
+                            callback(info.filename, member, objectId)
+                        else:
+                            target = os.path.realpath(os.path.join(directory or '.', info.filename))
+                            root = os.path.realpath(directory or '.')
+                            if os.path.commonpath([root, target]) != root:
+                                raise ValueError('Unsafe path in zip: ' + info.filename)
+                            os.makedirs(os.path.dirname(target), exist_ok=True)
+                            with open(target, 'wb', buffering=blockSize) as outfile:
+                                shutil.copyfileobj(member, outfile, blockSize)
+                            result['filename'] = target
+                    results.append(result)
+        finally:
+            archive.close()
+        return results
+
+    ############################################################################
+    # Runs a complete bulk download: submit, poll, download and clean up.
+    # Each zip is downloaded into directory as soon as its own status turns DONE,
+    # while the server is still building the others. Zips that are not ready are
+    # polled with getZipStatus(), starting every pollInterval seconds and backing
+    # off by backoffFactor up to maxPollInterval.
+    # workers limits how many zips download at the same time. timeout (seconds)
+    # gives up on zips that have not finished building by then.
+    #
+    # The server only offers a clear-everything call, so clearBulkRequests() is
+    # only called if clear=True, every one of our zips downloaded without error
+    # and every zip still on the server is one of ours. Otherwise the zips are
+    # left on the server, so failed or unfinished ones can be retried and other
+    # owners' zips are kept.
+    #
+    # With targetBytes and/or maxIds set, ids (or metadata dicts) are first
+    # split into size-balanced jobs by planBulkJobs() and submitted together by
+    # submitBulkJobs(). Otherwise all ids go in one request. A job the server
+    # does not accept is reported as a result with zipName None and the
+    # request error, and the accepted jobs are downloaded as usual.
+    #
+    # Returns {'zips': [results], 'cleared': True/False}, one result per zip:
+    # {'zipName': ..., 'status': ..., 'ids': [ids in the job that made it], 'filename': ...,
+    #  'size': bytes, 'duration': seconds, 'error': None or message}
+
+    def bulkDownload(self, ids, directory='.', workers=4, pollInterval=1.0, maxPollInterval=30.0, backoffFactor=1.5, timeout=None, clear=True, targetBytes=None, maxIds=None):
+        from concurrent.futures import ThreadPoolExecutor
+        os.makedirs(directory, exist_ok=True)
+        started = time.time()
+        if targetBytes or maxIds:
+            submitted = self.submitBulkJobs(self.planBulkJobs(ids, targetBytes or BULK_TARGET_BYTES, maxIds or BULK_MAX_IDS), workers=workers)
+        else:
+            ids = [_objectIdOf(obj) for obj in ids]
+            submitted = [{'ids': ids, 'bytes': None, 'zips': self.initiateBulkDownload(ids).json(), 'error': None}]
+        rejected = [{'zipName': None, 'status': 'FAILED', 'ids': job['ids'], 'filename': None, 'size': -1, 'duration': 0.0,
+                     'error': 'Bulk download request failed: ' + job['error']} for job in submitted if job['error']]
+        zips = [item for job in submitted for item in job['zips']]
+        zipIds = dict((item['zipName'], job['ids']) for job in submitted for item in job['zips'])
+
+        def fetch(zipName):
+            result = {'zipName': zipName, 'status': 'DONE', 'filename': os.path.join(directory, zipName), 'size': -1, 'duration': 0.0, 'error': None}
+            downloadStarted = time.time()
+            try:
+                result['size'] = self._downloadContent(self.apiUrl + '/bulk/download/' + zipName, result['filename'])
+            except Exception as e:
+                result['error'] = str(e)
+            result['duration'] = time.time() - downloadStarted
+            return result
+
+        results = {}
+        futures = {}
+        waiting = {}
+        for item in zips:
+            waiting[item['zipName']] = {'status': item['status'], 'interval': pollInterval, 'nextPoll': time.time()}
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while waiting:
+                now = time.time()
+                for zipName, state in list(waiting.items()):
+                    if state['status'] != 'DONE' and now >= state['nextPoll']:
+                        pollStarted = time.time()
+                        try:
+                            state['status'] = self.getZipStatus(zipName).json()['status']
+                        except requests.HTTPError as e:
+                            state['status'] = 'ERROR'
+                            state['error'] = str(e)
+                        self.metrics.timing('bulk_status_poll', time.time() - pollStarted)
+                        state['interval'] = min(state['interval'] * backoffFactor, maxPollInterval)
+                        state['nextPoll'] = now + state['interval']
+                    if state['status'] == 'DONE':
+                        self.metrics.timing('bulk_zip_wait', time.time() - started)
+                        log.info('%s is ready', zipName)
+                        futures[zipName] = pool.submit(fetch, zipName)
+                        del waiting[zipName]
+                    elif state['status'] in ('FAILED', 'ERROR'):
+                        results[zipName] = {'zipName': zipName, 'status': state['status'], 'filename': None, 'size': -1, 'duration': 0.0, 'error': state.get('error', 'zip generation failed')}
+                        del waiting[zipName]
+                    elif timeout is not None and now - started > timeout:
+                        results[zipName] = {'zipName': zipName, 'status': state['status'], 'filename': None, 'size': -1, 'duration': 0.0, 'error': 'timed out waiting for zip'}
+                        del waiting[zipName]
+                if waiting:
+                    pause = max(0.0, min(state['nextPoll'] for state in waiting.values()) - time.time())
+                    time.sleep(pause)
+                    self.metrics.timing('bulk_status_wait', pause)
+            for zipName, future in futures.items():
+                results[zipName] = future.result()
+
+        cleared = False
+        if clear and not rejected and all(result['error'] is None for result in results.values()):
+            ours = set(item['zipName'] for item in zips)
+            onServer = set(item['zipName'] for item in self.getBulkStatus().json())
+            if onServer <= ours:
+                self.clearBulkRequests()
+                cleared = True
+        for zipName, result in results.items():
+            result['ids'] = zipIds[zipName]
+        return {'zips': [results[item['zipName']] for item in zips] + rejected, 'cleared': cleared}
+
+    ############################################################################
+    # Splits objects into bulk jobs of about targetBytes of storedBytes and at
+    # most maxIds ids each. objects may be ids or metadata dicts; sizes missing
+    # from the dicts are looked up with getObjectsMetaData(). See planCSS_BulkJobs().
+
+    def planBulkJobs(self, objects, targetBytes=None, maxIds=None):
+        objects = list(objects)
+        missing = [_objectIdOf(obj) for obj in objects if not isinstance(obj, dict) or obj.get('storedBytes') is None]
+        if missing:
+            metadata = self.getObjectsMetaData(missing)
+            objects = [obj if isinstance(obj, dict) and obj.get('storedBytes') is not None else metadata[_objectIdOf(obj)] for obj in objects]
+        return planCSS_BulkJobs(objects, targetBytes or BULK_TARGET_BYTES, maxIds or BULK_MAX_IDS)
+
+    ############################################################################
+    # Submits every job from planBulkJobs() with initiateBulkDownload(),
+    # `workers` at a time. Returns the jobs in the same order, each with the
+    # zips the server created for it:
+    # {'ids': [...], 'bytes': n, 'zips': [{'zipName': ..., 'status': ...}], 'error': None or message}
+
+    def submitBulkJobs(self, jobs, workers=4):
+        from concurrent.futures import ThreadPoolExecutor
+
+        def submit(job):
+            submitted = {'ids': job['ids'], 'bytes': job['bytes'], 'zips': [], 'error': None}
+            try:
+                submitted['zips'] = self.initiateBulkDownload(job['ids']).json()
+            except requests.RequestException as e:
+                submitted['error'] = str(e)
+            return submitted
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(submit, jobs))
+
+    ############################################################################
+    # Clears bulk download requests from the server. Returns the response.
+
+    def clearBulkRequests(self, requestUrl=None):
+        if requestUrl is None:
+            requestUrl = self.apiUrl + '/bulk/download/clear'
+        params = {
+            "Accept": "application/json",
+            }
+        response = self._request('PUT', requestUrl, params=params)
+        response.raise_for_status()
+        return response
+
 
 ################################################################################
     #  This function returns a list of your objects.
@@ -53,80 +1400,197 @@ import random
     # By default, the function returns a complete list sorted by creation time.
     # Records are pulled in batches of 100, and added to a list.
     # When all records have been downloaded, the list is returned.
-    # If you're expecting massive results, uncomment the sleep delay to rete limit your requests
-    # Also think about bringing the response into a file depending upon memory constraints of the system
-
-def getCSS_ObjectsList(accessToken, requestUrl='https://api.8x8.com/storage/us-west/v3/objects', filter='', pageKey=0, limit=100, sortField='createdTime', sortDirection='DESC'):
-    complete = False
-    with requests.Session() as s:
-        s.auth = OAuth2BearerToken(accessToken)
-        data = []
-        while (pageKey == 0 or not complete):
-            s.params = {"Content-Type": "application/json",
-                        'Accept': 'application/json',
-                        'filter': filter,
-                        'pageKey': pageKey,
-                        'limit': limit,
-                        'sortField': sortField,
-                        'sortDirection': sortDirection}
-            r = s.get(requestUrl)
-            r.raise_for_status()
-            pageKey = pageKey + 100
-            complete = r.json()['lastPage']
-            for item in r.json()["content"]:
-                data.append(item)
-            print('data size', ':', len(data))
-            time.sleep(.1) 
-    return data
+    # If you're expecting massive results, use iterCSS_ObjectsList() to work on
+    # objects as they arrive, or saveCSS_ObjectsList() to write them to a file.
+    # Pass workers=N to fetch N pages at a time. Results come back in the same
+    # order as a sequential listing.
+    # ex: getCSS_ObjectsList(token, filter='type==callcenterrecording', workers=8)
+
+def getCSS_ObjectsList(accessToken, requestUrl='https://api.8x8.com/storage/us-west/v3/objects', filter='', pageKey=0, limit=100, sortField='createdTime', sortDirection='DESC', workers=1):
+    client = CSSClient(accessToken, session=_getSharedSession(workers))
+    return client.getObjectsList(filter=filter, pageKey=pageKey, limit=limit, sortField=sortField, sortDirection=sortDirection, requestUrl=requestUrl, workers=workers)
+
+
+################################################################################
+# iterCSS_ObjectsList() takes the same arguments as getCSS_ObjectsList(), but
+# is a generator. Objects are yielded as each page arrives, so memory use stays
+# flat no matter how many objects the tenant holds, and processing can start on
+# the first page. Pass pages=True to get each page as a list instead.
+# ex: for item in iterCSS_ObjectsList(token, filter='type==callcenterrecording'):
+#         print(item['id'])
+
+def iterCSS_ObjectsList(accessToken, requestUrl='https://api.8x8.com/storage/us-west/v3/objects', filter='', pageKey=0, limit=100, sortField='createdTime', sortDirection='DESC', workers=1, pages=False):
+    client = CSSClient(accessToken, session=_getSharedSession(workers))
+    return client.iterObjectsList(filter=filter, pageKey=pageKey, limit=limit, sortField=sortField, sortDirection=sortDirection, requestUrl=requestUrl, workers=workers, pages=pages)
+
+################################################################################
+# saveCSS_ObjectsList() streams the listing straight to a JSON Lines file,
+# one object per line. It returns the number of objects written.
+# ex: saveCSS_ObjectsList(token, 'objects.jsonl', filter='type==callcenterrecording')
+
+def saveCSS_ObjectsList(accessToken, filename, requestUrl='https://api.8x8.com/storage/us-west/v3/objects', filter='', pageKey=0, limit=100, sortField='createdTime', sortDirection='DESC', workers=1):
+    client = CSSClient(accessToken, session=_getSharedSession(workers))
+    return client.saveObjectsList(filename, filter=filter, pageKey=pageKey, limit=limit, sortField=sortField, sortDirection=sortDirection, requestUrl=requestUrl, workers=workers)
+
+
+################################################################################
+# getCSS_ObjectsListSharded() lists every object created between start and end
+# using several processes at once. The range is cut into `shards` createdTime
+# windows, each window is listed by its own process over its own connections,
+# and the results are merged in sort order with duplicates removed.
+# Use it to backfill years of recordings on a large tenant.
+# ex: import datetime
+#     objects = getCSS_ObjectsListSharded(token, datetime.datetime(2020, 1, 1), datetime.datetime(2024, 1, 1),
+#                                         shards=48, filter='type==callcenterrecording')
+
+def getCSS_ObjectsListSharded(accessToken, start, end, shards=16, processes=None, filter='', limit=100, sortField='createdTime', sortDirection='DESC', workers=1, region=CSS_DEFAULT_REGION, baseUrl=CSS_BASE_URL):
+    client = CSSClient(accessToken, region=region, baseUrl=baseUrl, session=_getSharedSession())
+    return client.getObjectsSharded(start, end, shards=shards, processes=processes, filter=filter, limit=limit, sortField=sortField, sortDirection=sortDirection, workers=workers)
 
 
 ################################################################################
 # This function retrieves the metadata for the specified object id.
 # It returns a json object.
 
-def getCSS_ObjectMetaData(accessToken, objectId, requestUrl='https://api.8x8.com/storage/us-west/v3/objects'):
+def getCSS_ObjectMetaData(accessToken, objectId, requestUrl='https://api.8x8.com/storage/us-west/v3/objects', cache=None):
     # json formatted response from API as per documentation:
     # https://8x8gateway-8x8apis.apigee.io/docs/css/1/routes/objects/%7BobjectId%7D/metadata/get
     # Function returns json object with same structure
-    metadataUrl = requestUrl + '/' + objectId + '/metadata'
-    with requests.Session() as s:
-        s.auth = OAuth2BearerToken(accessToken)
-        response = s.get(metadataUrl, stream = True)
-        response.raise_for_status()
-    return response.json()
+    # Pass a MetadataCache as cache to skip the request for recently seen ids.
+    client = CSSClient(accessToken, session=_getSharedSession(), metadataCache=cache)
+    return client.getObjectMetaData(objectId, requestUrl=requestUrl)
+
+################################################################################
+# This function retrieves the metadata for a list of object ids at once.
+# Lookups run `workers` at a time over one pooled connection, and anything in
+# cache (a MetadataCache) is answered without a request.
+# It returns a dict of {objectId: metadata}. Pass a dict as errors to collect
+# {objectId: message} for ids that could not be looked up instead of raising.
+# ex: cache = MetadataCache(ttl=3600)
+#     errors = {}
+#     metadata = getCSS_ObjectsMetaData(token, ids, cache=cache, errors=errors)
+#     print(cache.stats(), len(errors), 'lookups failed')
+
+def getCSS_ObjectsMetaData(accessToken, objectIds, workers=8, requestUrl='https://api.8x8.com/storage/us-west/v3/objects', cache=None, errors=None):
+    client = CSSClient(accessToken, session=_getSharedSession(workers), metadataCache=cache)
+    return client.getObjectsMetaData(objectIds, workers=workers, requestUrl=requestUrl, errors=errors)
+
+################################################################################
+# _HTTPRangeFile is a read-only, seekable file over a remote object, used by
+# extractBulkContent() so zipfile can read an archive without downloading it
+# first. Reads are served from one cached block of blockSize bytes, fetched
+# with an HTTP Range request whenever a read falls outside it.
+
+class _HTTPRangeFile(io.RawIOBase):
+    def __init__(self, client, url, size, blockSize=1048576):
+        self.client = client
+        self.url = url
+        self.size = size
+        self.blockSize = blockSize
+        self.position = 0
+        self.blockStart = 0
+        self.block = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position = self.position + offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        if size <= 0:
+            return b''
+        end = self.position + size
+        if self.position < self.blockStart or end > self.blockStart + len(self.block):
+            self.blockStart = self.position
+            last = min(self.size, self.position + max(size, self.blockSize)) - 1
+            with self.client._transferSlot():
+                response = self.client._request('GET', self.url, headers={'Range': 'bytes=' + str(self.position) + '-' + str(last)})
+                response.raise_for_status()
+                # A 200 carries the whole object and a 206 from another offset
+                # carries the wrong bytes; either would corrupt the archive.
+                start = _contentRange(response)[0]
+                if response.status_code != 206 or start != self.position:
+                    raise ValueError('Range request for bytes ' + str(self.position) + '-' + str(last) + ' of ' + self.url +
+                                  ' got ' + str(response.status_code) + ' ' + response.headers.get('Content-Range', 'without Content-Range'))
+                self.block = response.content
+                self.client._transferred(skunkworksMetrics.endpointOf(self.url), len(self.block))
+        offset = self.position - self.blockStart
+        data = self.block[offset:offset + size]
+        self.position = self.position + len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
 
 ################################################################################
 # This function pulls the content of the object and writes to a binary file
-# It returns the size of the file in bytes, or -1 if there was a problem writing.
-
-def getCSS_ObjectContent(accessToken, objectId, filename='data.dat', textMode=False, requestUrl='https://api.8x8.com/storage/us-west/v3/objects', presignUrl=False):
-    import os
-    contentUrl = requestUrl + '/' + objectId + '/content'
-    with requests.Session() as s:
-        s.auth = OAuth2BearerToken(accessToken)
-        s.params = {"Content-Type": "application/json"}
-
-        writeMode = 'wt'
-        if textMode == False:
-            writeMode = 'wb'
-
-        outfile = open(filename, writeMode)
-
-        print('Fetching content',end='')
-        response = s.get(contentUrl, stream = True)
-        for chunk in response.iter_content(chunk_size=1024):
-            outfile.write(chunk)
-            print('.',end='')
-        print('\ndone')
-        response.raise_for_status()
+# It returns the size of the file in bytes.
+# Interrupted downloads are resumed, and the file only appears under filename
+# once it is complete. The content is verified against the checksum in the
+# object's metadata as it downloads. The metadata is looked up unless you pass
+# checksum and checksumType yourself, or verify=False.
+# ex: meta = getCSS_ObjectMetaData(token, objectId)
+#     getCSS_ObjectContent(token, objectId, 'call.wav', checksum=meta['checksum'], checksumType=meta['checksumType'])
+#
+# Instead of a filename, content can be streamed into a sink: any writable
+# file-like object, a subprocess.Popen started with stdin=subprocess.PIPE, or
+# a function that is called with each buffer. The function then returns the
+# number of bytes delivered.
+# ex: transcoder = subprocess.Popen(['ffmpeg', '-i', '-', 'call.mp3'], stdin=subprocess.PIPE)
+#     getCSS_ObjectContent(token, objectId, sink=transcoder)
+#     transcoder.stdin.close()
+#     transcoder.wait()
 
-        outfile.close()
+def getCSS_ObjectContent(accessToken, objectId, filename='data.dat', textMode=False, requestUrl='https://api.8x8.com/storage/us-west/v3/objects', presignUrl=False, checksum=None, checksumType=None, retries=5, sink=None, chunkSize=1048576, verify=True):
+    client = CSSClient(accessToken, session=_getSharedSession())
+    return client.getObjectContent(objectId, filename=filename, textMode=textMode, requestUrl=requestUrl, presignUrl=presignUrl, checksum=checksum, checksumType=checksumType, retries=retries, sink=sink, chunkSize=chunkSize, verify=verify)
 
-        try:
-            size = os.path.getsize(filename)
-        except:
-            size = -1
-    return size
+################################################################################
+# This function downloads a list of objects in parallel into a directory.
+# Pass a list of object ids, or the metadata dicts from getCSS_ObjectsList().
+# It returns a list of results, one per object, formatted like this:
+# [{'id': '...', 'filename': 'recordings/....wav', 'size': 48213, 'duration': 0.21, 'error': None}]
+# For many small objects this is usually quicker than a bulk zip download.
+# ex: getCSS_Objects(token, getCSS_ObjectsList(token), directory='recordings', workers=16)
+
+def getCSS_Objects(accessToken, objects, directory='.', workers=8, chunkSize=1048576, requestUrl='https://api.8x8.com/storage/us-west/v3/objects'):
+    client = CSSClient(accessToken, session=_getSharedSession(workers))
+    return client.downloadObjects(objects, directory=directory, workers=workers, chunkSize=chunkSize, requestUrl=requestUrl)
+
+################################################################################
+# This function exports every object matching filter into a directory, with
+# listing and downloading overlapped: downloads start on the first page while
+# later pages are still being listed. A bounded queue between the two keeps
+# memory flat. mode='objects' downloads objects one by one with `workers`
+# parallel downloads; mode='bulk' sends them as bulk jobs of batchSize ids.
+# It returns a summary formatted like this:
+# {'listed': 5000, 'downloaded': 4998, 'failed': 2, 'bytes': 240117760, 'seconds': 95.2, 'errors': [...], 'listError': None}
+# ex: exportCSS_Objects(token, 'recordings', filter='type==callcenterrecording', workers=16)
+
+def exportCSS_Objects(accessToken, directory='.', filter='', sortField='createdTime', sortDirection='DESC', mode='objects', workers=8, batchSize=100, queueSize=1000, listWorkers=1, onResult=None, region=CSS_DEFAULT_REGION):
+    # Bulk jobs each poll and download two zips at a time.
+    poolSize = workers * (3 if mode == 'bulk' else 1) + listWorkers
+    client = CSSClient(accessToken, region=region, session=_getSharedSession(poolSize))
+    return client.pipelineDownload(directory, filter=filter, sortField=sortField, sortDirection=sortDirection, mode=mode, workers=workers, batchSize=batchSize, queueSize=queueSize, listWorkers=listWorkers, onResult=onResult)
 
 ################################################################################
 # This function initiates the bulk download process. It expects a token, and
@@ -135,17 +1599,8 @@ def getCSS_ObjectContent(accessToken, objectId, filename='data.dat', textMode=Fa
 # [{'zipName': 'cd209587-b204-4934-b879-d1e2920ca2a3.zip', 'status': 'DONE'}, {'zipName': 'c59920c2-dd89-49db-9e09-bf901f81d2bd.zip', 'status': 'DONE'}, {'zipName': 'f9fa7e80-d220-4bc0-83c1-dd4697da4935.zip', 'status': 'NOT_STARTED'}]
 
 def initiateCSS_BulkDownload(accessToken, ids, requestUrl = 'https://api.8x8.com/storage/us-west/v3/bulk/download/start'):
-    contentUrl = requestUrl
-    with requests.Session() as s:
-        s.auth = OAuth2BearerToken(accessToken)
-        s.params = {
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-            }
-        print('Initiating Request.')
-        response = s.post(contentUrl, json=ids)
-        response.raise_for_status()
-    return response
+    client = CSSClient(accessToken, session=_getSharedSession())
+    return client.initiateBulkDownload(ids, requestUrl=requestUrl)
 
 ################################################################################
 # This function reports the status of all bulk download requests
@@ -153,74 +1608,70 @@ def initiateCSS_BulkDownload(accessToken, ids, requestUrl = 'https://api.8x8.com
 # [{'zipName': 'cd209587-b204-4934-b879-d1e2920ca2a3.zip', 'status': 'DONE'}, {'zipName': 'c59920c2-dd89-49db-9e09-bf901f81d2bd.zip', 'status': 'DONE'}, {'zipName': 'f9fa7e80-d220-4bc0-83c1-dd4697da4935.zip', 'status': 'NOT_STARTED'}]
 
 def getCSS_BulkStatus(accessToken, requestUrl = 'https://api.8x8.com/storage/us-west/v3/bulk/download/status'):
-    contentUrl = requestUrl
-    with requests.Session() as s:
-        s.auth = OAuth2BearerToken(accessToken)
-        s.params = {
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-            }
-        response = s.get(contentUrl)
-        response.raise_for_status()
-    return response
+    client = CSSClient(accessToken, session=_getSharedSession())
+    return client.getBulkStatus(requestUrl=requestUrl)
 
 ################################################################################
 def getCSS_zipStatus(accessToken, zipName, requestUrl = 'https://api.8x8.com/storage/us-west/v3/bulk/download/status'):
-    contentUrl = requestUrl + '/' + zipName
-
-    with requests.Session() as s:
-        s.auth = OAuth2BearerToken(accessToken)
-        s.params = {
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-            }
-        response = s.get(contentUrl)
-        response.raise_for_status()
-    return response
+    client = CSSClient(accessToken, session=_getSharedSession())
+    return client.getZipStatus(zipName, requestUrl=requestUrl)
 
 
 ################################################################################
 # This function pulls the content of the zipfile and writes to a binary file
-# It returns the size of the file in bytes, or -1 if there was a problem writing.
-
-def getCSS_BulkContent(accessToken, zipName, filename='data.zip', requestUrl='https://api.8x8.com/storage/us-west/v3/bulk/download'):
-    import os
-    contentUrl = requestUrl + '/' + zipName
-    with requests.Session() as s:
-        s.auth = OAuth2BearerToken(accessToken)
-        s.params = {"Content-Type": "application/json"}
-
-        writeMode = 'wb'
-        outfile = open(filename, writeMode)
-
-        print('Fetching content',end='')
-        response = s.get(contentUrl, stream = True)
-        for chunk in response.iter_content(chunk_size=1024):
-            outfile.write(chunk)
-            print('.',end='')
-        print('\ndone')
-        response.raise_for_status()
+# It returns the size of the file in bytes.
+# Interrupted downloads are resumed from where they stopped.
+# Pass sink to stream the zip somewhere other than a file, as with
+# getCSS_ObjectContent().
 
-        outfile.close()
+def getCSS_BulkContent(accessToken, zipName, filename='data.zip', requestUrl='https://api.8x8.com/storage/us-west/v3/bulk/download', retries=5, sink=None, chunkSize=1048576):
+    client = CSSClient(accessToken, session=_getSharedSession())
+    return client.getBulkContent(zipName, filename=filename, requestUrl=requestUrl, retries=retries, sink=sink, chunkSize=chunkSize)
 
-        try:
-            size = os.path.getsize(filename)
-        except:
-            size = -1
-    return size
+################################################################################
+# This function runs the whole bulk download process for a list of object ids.
+# Zips are downloaded into directory as soon as each one is ready, while the
+# server is still building the rest. When everything is down, the server is
+# cleared, unless it also holds zips that someone else requested.
+# Pass targetBytes and/or maxIds to split a large listing into several evenly
+# sized bulk jobs (see planCSS_BulkJobs()) instead of one huge request.
+# It returns a summary formatted like this:
+# {'zips': [{'zipName': 'cd20...a3.zip', 'status': 'DONE', 'ids': [...], 'filename': 'exports/cd20...a3.zip', 'size': 1048576, 'duration': 2.4, 'error': None}], 'cleared': True}
+# baseUrl points it at another CSS deployment, as for getCSS_ObjectsListSharded().
+# ex: downloadCSS_Bulk(token, objectList, directory='exports', targetBytes=512 * 1024 * 1024, maxIds=500)
+
+def downloadCSS_Bulk(accessToken, ids, directory='.', workers=4, pollInterval=1.0, maxPollInterval=30.0, timeout=None, clear=True, region=CSS_DEFAULT_REGION, targetBytes=None, maxIds=None, baseUrl=CSS_BASE_URL):
+    client = CSSClient(accessToken, region=region, baseUrl=baseUrl, session=_getSharedSession(workers + 1))
+    return client.bulkDownload(ids, directory=directory, workers=workers, pollInterval=pollInterval, maxPollInterval=maxPollInterval, timeout=timeout, clear=clear, targetBytes=targetBytes, maxIds=maxIds)
 
 ################################################################################
+# This function splits a list of objects into size-balanced bulk jobs, submits
+# them all at once, and reports which ids went into which zips.
+# objects can be the listing from getCSS_ObjectsList() or a list of ids (their
+# sizes are then looked up). It returns a list formatted like this:
+# [{'ids': [...], 'bytes': 536870912, 'zips': [{'zipName': 'cd20...a3.zip', 'status': 'NOT_STARTED'}], 'error': None}]
+# ex: jobs = submitCSS_BulkJobs(token, objectList, targetBytes=512 * 1024 * 1024)
 
-# This function clears bulk download requests from the Server
-def clearCSS_BulkRequests(accessToken, requestUrl='https://api.8x8.com/storage/us-west/v3/bulk/download/clear'):
-    contentUrl = requestUrl
-    with requests.Session() as s:
-        s.auth = OAuth2BearerToken(accessToken)
-        s.params = {
-            "Accept": "application/json",
-            }
-        response = s.put(contentUrl)
-        response.raise_for_status()
-    return response
+def submitCSS_BulkJobs(accessToken, objects, targetBytes=BULK_TARGET_BYTES, maxIds=BULK_MAX_IDS, workers=4, region=CSS_DEFAULT_REGION):
+    client = CSSClient(accessToken, region=region, session=_getSharedSession(workers))
+    return client.submitBulkJobs(client.planBulkJobs(objects, targetBytes, maxIds), workers=workers)
+
+################################################################################
+# This function extracts the objects in a bulk download zip straight into a
+# directory, without writing the zip itself to disk first. Pass objects (the
+# listing, or a list of ids) to have each member matched to its object id, or
+# a callback(member, fileobj, objectId) to process members without touching
+# disk at all. It returns a list formatted like this:
+# [{'member': 'cd20....wav', 'objectId': 'cd20...', 'filename': '/exports/cd20....wav', 'size': 48213}]
+# ex: extractCSS_BulkContent(token, item['zipName'], directory='recordings', objects=objectList)
+
+def extractCSS_BulkContent(accessToken, zipName, directory=None, callback=None, objects=None, requestUrl='https://api.8x8.com/storage/us-west/v3/bulk/download'):
+    client = CSSClient(accessToken, session=_getSharedSession())
+    return client.extractBulkContent(zipName, directory=directory, callback=callback, objects=objects, requestUrl=requestUrl)
 
 ################################################################################
+
+# This function clears bulk download requests from the Server
+def clearCSS_BulkRequests(accessToken, requestUrl='https://api.8x8.com/storage/us-west/v3/bulk/download/clear'):
+    client = CSSClient(accessToken, session=_getSharedSession())
+    return client.clearBulkRequests(requestUrl=requestUrl)
@@ -0,0 +1,158 @@
+# skunkworksExport runs CSS exports for several tenants and regions at once.
+
+# Each target is one set of credentials in one storage region. Every tenant
+# gets its own TokenProvider, shared by its targets in different regions, and
+# every target gets its own connection pool, request rate limiter and metrics
+# registry, so one slow or throttled region cannot starve another. All
+# targets share one global budget: at most maxConcurrency content transfers
+# at a time, and optionally at most `bandwidth` bytes per second, across every
+# tenant and region together.
+
+# Listing and downloading for each target run through
+# CSSClient.pipelineDownload(), so they overlap within a target too.
+
+# ex: targets = [{'name': 'acme-us', 'credentials': 'acme.json', 'region': 'us-west'},
+#                {'name': 'acme-eu', 'credentials': 'acme.json', 'region': 'eu-central'},
+#                {'name': 'globex', 'credentials': 'globex.json', 'filter': 'type==callcenterrecording'}]
+#     report = exportCSS_Targets(targets, 'exports', maxConcurrency=32, bandwidth=50 * 1024 * 1024)
+#     print(formatExportReport(report))
+
+import logging
+import os
+import threading
+import time
+
+from skunkworksAuth import TokenProvider
+from skunkworksAuth import clientCredentialsAuthorize
+from skunkworksCSS import CSS_BASE_URL
+from skunkworksCSS import CSS_DEFAULT_REGION
+from skunkworksCSS import CSSClient
+from skunkworksCSS import RateLimiter
+from skunkworksMetrics import MetricsRegistry
+
+log = logging.getLogger('skunkworksExport')
+
+
+################################################################################
+# exportCSS_Targets() exports every target concurrently.
+#
+# targets        - list of dicts. 'credentials' is required; the optional keys
+#                  are 'name' (default region + credentials file name),
+#                  'region', 'authorize', 'authendpoint', 'filter', 'mode'
+#                  ('objects' or 'bulk') and 'directory' (default
+#                  directory/name).
+# directory      - root directory for the export
+# maxConcurrency - content transfers allowed at once across all targets
+# bandwidth      - optional bytes per second shared by all targets
+# workers        - download workers per target
+# poolSize       - keep-alive connections per target
+# tokenCache     - optional TokenProvider cache file shared by the targets
+# progressInterval - seconds between combined progress lines in the log
+# onProgress     - optional callback(name, result) for each finished download
+#                  (each zip in mode='bulk')
+#
+# Returns a combined report:
+# {'seconds': s,
+#  'totals': {'listed': n, 'downloaded': n, 'failed': n, 'bytes': n},
+#  'targets': {name: {'region': ..., 'directory': ..., 'summary': pipeline summary
+#                     or None, 'error': None or message, 'metrics': registry snapshot}}}
+
+def exportCSS_Targets(targets, directory='exports', maxConcurrency=16, bandwidth=None, workers=8, poolSize=None, tokenCache=None, mode='objects', batchSize=100, queueSize=1000, progressInterval=10.0, onProgress=None, baseUrl=CSS_BASE_URL):
+    from concurrent.futures import ThreadPoolExecutor
+    transferSlots = threading.BoundedSemaphore(maxConcurrency)
+    bandwidthLimiter = None
+    if bandwidth:
+        bandwidthLimiter = RateLimiter(rate=bandwidth, burst=bandwidth, minRate=bandwidth, maxRate=bandwidth)
+
+    started = time.time()
+    lock = threading.Lock()
+    progress = {}
+    report = {'seconds': 0.0, 'totals': {}, 'targets': {}}
+    providers = {}
+    runs = []
+    for target in targets:
+        region = target.get('region', CSS_DEFAULT_REGION)
+        name = target.get('name') or region + '-' + os.path.splitext(os.path.basename(target['credentials']))[0]
+        if name in report['targets']:
+            raise ValueError('Duplicate export target name: ' + name)
+        authorize = target.get('authorize', clientCredentialsAuthorize)
+        key = (os.path.abspath(target['credentials']), target.get('authendpoint'), authorize)
+        provider = providers.get(key)
+        if provider is None:
+            provider = TokenProvider(authorize=authorize, credentials=target['credentials'], authendpoint=target.get('authendpoint'), cacheFile=tokenCache)
+            providers[key] = provider
+        metrics = MetricsRegistry()
+        client = CSSClient(provider, region=region, baseUrl=baseUrl, poolSize=poolSize or workers, rateLimiter=RateLimiter(),
+                           metrics=metrics, transferSlots=transferSlots, bandwidthLimiter=bandwidthLimiter)
+        targetDirectory = target.get('directory') or os.path.join(directory, name)
+        progress[name] = {'done': 0, 'failed': 0, 'bytes': 0}
+        report['targets'][name] = {'region': region, 'directory': targetDirectory, 'summary': None, 'error': None, 'metrics': None}
+        runs.append((name, client, target, targetDirectory))
+
+    def run(name, client, target, targetDirectory):
+        def onResult(result):
+            with lock:
+                if result['error'] is None:
+                    progress[name]['done'] += 1
+                    progress[name]['bytes'] += max(result['size'], 0)
+                else:
+                    progress[name]['failed'] += 1
+            if onProgress is not None:
+                onProgress(name, result)
+
+        try:
+            report['targets'][name]['summary'] = client.pipelineDownload(targetDirectory, filter=target.get('filter', ''), mode=target.get('mode', mode),
+                                                                         workers=workers, batchSize=batchSize, queueSize=queueSize, onResult=onResult)
+        except Exception as e:
+            report['targets'][name]['error'] = str(e)
+            log.error('Export of %s failed: %s', name, e)
+        finally:
+            report['targets'][name]['metrics'] = client.metrics.snapshot()
+            client.close()
+
+    finished = threading.Event()
+
+    def reportProgress():
+        while not finished.wait(progressInterval):
+            with lock:
+                done = sum(item['done'] for item in progress.values())
+                failed = sum(item['failed'] for item in progress.values())
+                moved = sum(item['bytes'] for item in progress.values())
+            elapsed = time.time() - started
+            log.info('%d transfers done, %d failed, %.1f MB at %.2f MB/s across %d targets',
+                     done, failed, moved / 1e6, moved / 1e6 / elapsed if elapsed else 0.0, len(runs))
+
+    reporter = threading.Thread(target=reportProgress, name='css-export-progress', daemon=True)
+    reporter.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(runs))) as pool:
+            for future in [pool.submit(run, *item) for item in runs]:
+                future.result()
+    finally:
+        finished.set()
+        reporter.join()
+
+    totals = {'listed': 0, 'downloaded': 0, 'failed': 0, 'bytes': 0}
+    for item in report['targets'].values():
+        for key in totals:
+            totals[key] += (item['summary'] or {}).get(key, 0)
+    report['totals'] = totals
+    report['seconds'] = time.time() - started
+    return report
+
+################################################################################
+# formatExportReport() lays out the report from exportCSS_Targets() as a table,
+# one line per target and a line of totals.
+
+def formatExportReport(report):
+    lines = ['%-24s %-12s %9s %11s %8s %12s %9s %s' % ('target', 'region', 'listed', 'downloaded', 'failed', 'MB', 'requests', 'error')]
+    for name, item in sorted(report['targets'].items()):
+        summary = item['summary'] or {}
+        requests = sum(entry['count'] for entry in (item['metrics'] or {}).get('requests', []))
+        lines.append('%-24s %-12s %9d %11d %8d %12.1f %9d %s' % (
+            name, item['region'], summary.get('listed', 0), summary.get('downloaded', 0), summary.get('failed', 0),
+            summary.get('bytes', 0) / 1e6, requests, item['error'] or summary.get('listError') or ''))
+    totals = report['totals']
+    lines.append('%-24s %-12s %9d %11d %8d %12.1f' % ('total', '', totals['listed'], totals['downloaded'], totals['failed'], totals['bytes'] / 1e6))
+    lines.append('%.1f seconds, %.2f MB/s' % (report['seconds'], totals['bytes'] / 1e6 / report['seconds'] if report['seconds'] else 0.0))
+    return '\n'.join(lines)
@@ -0,0 +1,199 @@
+# skunkworksMetrics records what the skunkworks libraries spend their time on.
+
+# Every request made by skunkworksCSS and skunkworksAuth is recorded in a
+# MetricsRegistry: latency per endpoint, status codes, bytes sent and received,
+# and retries. Named timings cover work that is not a single request, such as
+# the time spent polling for bulk zips to finish.
+
+# By default everything goes to one process wide registry. Read it with
+# getRegistry(), and export it with toJSON() or toPrometheus().
+# ex: from skunkworksMetrics import getRegistry
+#     ... run an export ...
+#     print(getRegistry().toPrometheus())
+
+# Hooks are called with every event as it is recorded, for shipping metrics
+# somewhere else or for live progress output. An event is a dict, ex:
+# {'type': 'request', 'service': 'css', 'endpoint': 'objects/{id}/content',
+#  'method': 'GET', 'status': 200, 'seconds': 0.12, 'bytesIn': 48213, 'bytesOut': 0}
+# ex: getRegistry().addHook(lambda event: print(event))
+
+import json
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+################################################################################
+# endpointOf() turns a request url into a low cardinality endpoint label.
+# Object ids and zip names are replaced by {id} and {zipName}, ex:
+# https://api.8x8.com/storage/us-west/v3/objects/1234/content -> objects/{id}/content
+# https://api.8x8.com/oauth/v2/token -> oauth/v2/token
+
+def endpointOf(url):
+    path = urlparse(url).path
+    match = re.search(r'/v3/(.*)$', path)
+    if not match:
+        return path.strip('/')
+    parts = match.group(1).strip('/').split('/')
+    if len(parts) == 3 and parts[0] == 'objects':
+        parts[1] = '{id}'
+    elif len(parts) == 4 and parts[:3] == ['bulk', 'download', 'status']:
+        parts[3] = '{zipName}'
+    elif len(parts) == 3 and parts[:2] == ['bulk', 'download'] and parts[2] not in ('start', 'status', 'clear'):
+        parts[2] = '{zipName}'
+    return '/'.join(parts)
+
+
+################################################################################
+# MetricsRegistry holds counters and timings. It is safe to share between
+# threads.
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.requests = {}
+            self.statuses = {}
+            self.retries = {}
+            self.timings = {}
+
+    def addHook(self, hook):
+        with self._lock:
+            self._hooks.append(hook)
+
+    def removeHook(self, hook):
+        with self._lock:
+            self._hooks.remove(hook)
+
+    def _emit(self, event):
+        for hook in list(self._hooks):
+            hook(event)
+
+    # One finished request. bytesIn is the response body size when it is
+    # known up front; streamed bodies report theirs through transfer().
+    def request(self, service, endpoint, method, status, seconds, bytesIn=0, bytesOut=0):
+        with self._lock:
+            stats = self.requests.get((service, endpoint))
+            if stats is None:
+                stats = {'count': 0, 'seconds': 0.0, 'max': 0.0, 'bytesIn': 0, 'bytesOut': 0, 'buckets': [0] * len(LATENCY_BUCKETS)}
+                self.requests[(service, endpoint)] = stats
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['bytesIn'] += bytesIn
+            stats['bytesOut'] += bytesOut
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][i] += 1
+                    break
+            key = (service, endpoint, method, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+        self._emit({'type': 'request', 'service': service, 'endpoint': endpoint, 'method': method,
+                    'status': status, 'seconds': seconds, 'bytesIn': bytesIn, 'bytesOut': bytesOut})
+
+    # Body bytes read from a streamed response.
+    def transfer(self, service, endpoint, nbytes):
+        with self._lock:
+            stats = self.requests.get((service, endpoint))
+            if stats is not None:
+                stats['bytesIn'] += nbytes
+        self._emit({'type': 'transfer', 'service': service, 'endpoint': endpoint, 'bytes': nbytes})
+
+    # A request that is being retried, with why: a status code, 'connection'
+    # or 'unauthorized'.
+    def retry(self, service, endpoint, reason):
+        with self._lock:
+            key = (service, endpoint, str(reason))
+            self.retries[key] = self.retries.get(key, 0) + 1
+        self._emit({'type': 'retry', 'service': service, 'endpoint': endpoint, 'reason': str(reason)})
+
+    # Time spent on a named piece of work, ex: bulk_status_poll.
+    def timing(self, name, seconds):
+        with self._lock:
+            stats = self.timings.setdefault(name, {'count': 0, 'seconds': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+        self._emit({'type': 'timing', 'name': name, 'seconds': seconds})
+
+    # A plain dict of everything recorded so far.
+    def snapshot(self):
+        with self._lock:
+            return {'started': self.started,
+                    'elapsed': time.time() - self.started,
+                    'requests': [dict(service=service, endpoint=endpoint, count=stats['count'], seconds=stats['seconds'],
+                                      max=stats['max'], bytesIn=stats['bytesIn'], bytesOut=stats['bytesOut'],
+                                      buckets=dict(zip([str(bound) for bound in LATENCY_BUCKETS], stats['buckets'])))
+                                 for (service, endpoint), stats in sorted(self.requests.items())],
+                    'statuses': [dict(service=service, endpoint=endpoint, method=method, status=status, count=count)
+                                 for (service, endpoint, method, status), count in sorted(self.statuses.items())],
+                    'retries': [dict(service=service, endpoint=endpoint, reason=reason, count=count)
+                                for (service, endpoint, reason), count in sorted(self.retries.items())],
+                    'timings': [dict(name=name, **stats) for name, stats in sorted(self.timings.items())]}
+
+    def toJSON(self, indent=None):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    # Prometheus text exposition format.
+    def toPrometheus(self):
+        snapshot = self.snapshot()
+        lines = ['# TYPE skunkworks_request_seconds histogram']
+        for item in snapshot['requests']:
+            labels = _labels(service=item['service'], endpoint=item['endpoint'])
+            total = 0
+            for bound in LATENCY_BUCKETS:
+                total += item['buckets'][str(bound)]
+                lines.append('skunkworks_request_seconds_bucket' + _labels(service=item['service'], endpoint=item['endpoint'], le=str(bound)) + ' ' + str(total))
+            lines.append('skunkworks_request_seconds_bucket' + _labels(service=item['service'], endpoint=item['endpoint'], le='+Inf') + ' ' + str(item['count']))
+            lines.append('skunkworks_request_seconds_sum' + labels + ' ' + repr(item['seconds']))
+            lines.append('skunkworks_request_seconds_count' + labels + ' ' + str(item['count']))
+        lines.append('# TYPE skunkworks_received_bytes_total counter')
+        for item in snapshot['requests']:
+            lines.append('skunkworks_received_bytes_total' + _labels(service=item['service'], endpoint=item['endpoint']) + ' ' + str(item['bytesIn']))
+        lines.append('# TYPE skunkworks_sent_bytes_total counter')
+        for item in snapshot['requests']:
+            lines.append('skunkworks_sent_bytes_total' + _labels(service=item['service'], endpoint=item['endpoint']) + ' ' + str(item['bytesOut']))
+        lines.append('# TYPE skunkworks_responses_total counter')
+        for item in snapshot['statuses']:
+            lines.append('skunkworks_responses_total' + _labels(service=item['service'], endpoint=item['endpoint'], method=item['method'], status=str(item['status'])) + ' ' + str(item['count']))
+        lines.append('# TYPE skunkworks_retries_total counter')
+        for item in snapshot['retries']:
+            lines.append('skunkworks_retries_total' + _labels(service=item['service'], endpoint=item['endpoint'], reason=item['reason']) + ' ' + str(item['count']))
+        lines.append('# TYPE skunkworks_timing_seconds summary')
+        for item in snapshot['timings']:
+            lines.append('skunkworks_timing_seconds_sum' + _labels(name=item['name']) + ' ' + repr(item['seconds']))
+            lines.append('skunkworks_timing_seconds_count' + _labels(name=item['name']) + ' ' + str(item['count']))
+        return '\n'.join(lines) + '\n'
+
+def _labels(**labels):
+    escaped = [name + '="' + value.replace('\\', '\\\\').replace('"', '\\"') + '"' for name, value in labels.items()]
+    return '{' + ','.join(escaped) + '}'
+
+
+################################################################################
+# The process wide registry used when a client is not given its own.
+
+_registry = MetricsRegistry()
+
+def getRegistry():
+    return _registry
+
+# Size of a prepared request's body, for the bytes sent counters.
+def bodySize(request):
+    body = getattr(request, 'body', None)
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    if isinstance(body, bytes):
+        return len(body)
+    return 0
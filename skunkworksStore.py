@@ -0,0 +1,177 @@
+# skunkworksStore is a content-addressed local store for CSS object content.
+
+# CSS metadata carries a checksum and checksumType for every object. The store
+# keeps one copy of each distinct content under its checksum. Before an object
+# is downloaded, the store is checked for that checksum. If the bytes are
+# already there, they are hard linked (or symlinked, or copied) to the
+# object's filename and nothing is fetched. New content is verified against
+# its checksum while it downloads, so the store only ever holds content that
+# matches its key. Objects whose checksumType cannot be verified are not
+# stored; they are downloaded straight to their filename.
+
+# Re-exports and overlapping date-range jobs then cost almost no bandwidth.
+
+# ex: store = ContentStore('css_store')
+#     results = store.fetchMany(CSSClient(token), getCSS_ObjectsList(token), 'recordings')
+#     print(sum(1 for item in results if item['deduplicated']), 'objects came from the store')
+
+import base64
+import binascii
+import contextlib
+import os
+import re
+import shutil
+import threading
+import time
+
+from skunkworksCSS import CSSClient
+from skunkworksCSS import _getSharedSession
+from skunkworksCSS import _newHasher
+
+
+################################################################################
+# ContentStore keeps content under root/<checksumType>/<xx>/<checksum>, where
+# the checksum is written as lower case hex and xx is its first two characters.
+# linkMode decides how stored content is placed at an object's filename:
+# 'hardlink' (default, falls back to a copy across filesystems), 'symlink' or
+# 'copy'. Hard and symbolic links share their bytes with the store, so treat
+# the placed files as read-only.
+
+class ContentStore:
+    def __init__(self, root='css_store', linkMode='hardlink'):
+        self.root = root
+        self.linkMode = linkMode
+        self._locks = {}
+        self._locksLock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    # Where content with this checksum lives in the store, or None when the
+    # metadata has no checksum or one of a type that cannot be verified.
+    def pathFor(self, metadata):
+        checksum = metadata.get('checksum')
+        if not checksum or _newHasher(metadata.get('checksumType')) is None:
+            return None
+        checksumType = re.sub(r'[^a-z0-9]', '', (metadata.get('checksumType') or 'unknown').lower())
+        key = _hexChecksum(checksum)
+        return os.path.join(self.root, checksumType, key[:2], key)
+
+    def has(self, metadata):
+        path = self.pathFor(metadata)
+        return path is not None and os.path.exists(path)
+
+    # One lock per checksum, so two objects with the same content are never
+    # downloaded into the store at the same time. A lock only exists while
+    # some thread holds or waits for it, so the table stays as small as the
+    # number of downloads in flight.
+    @contextlib.contextmanager
+    def _locked(self, path):
+        with self._locksLock:
+            entry = self._locks.get(path)
+            if entry is None:
+                entry = {'lock': threading.Lock(), 'users': 0}
+                self._locks[path] = entry
+            entry['users'] += 1
+        try:
+            with entry['lock']:
+                yield
+        finally:
+            with self._locksLock:
+                entry['users'] -= 1
+                if not entry['users']:
+                    del self._locks[path]
+
+    def _place(self, source, filename):
+        if os.path.lexists(filename):
+            os.remove(filename)
+        if self.linkMode == 'symlink':
+            os.symlink(os.path.abspath(source), filename)
+            return
+        if self.linkMode == 'hardlink':
+            try:
+                os.link(source, filename)
+                return
+            except OSError:
+                pass
+        shutil.copyfile(source, filename)
+
+    ############################################################################
+    # Puts the content of one object at filename.
+    # metadata must be the object's metadata dict (id, checksum, checksumType).
+    # Returns {'id': ..., 'filename': ..., 'size': bytes, 'duration': seconds,
+    #          'deduplicated': True if no download was needed, 'error': None or message}
+    # Objects without a verifiable checksum are downloaded straight to filename.
+
+    def fetch(self, client, metadata, filename, requestUrl=None):
+        if requestUrl is None:
+            requestUrl = client.apiUrl + '/objects'
+        contentUrl = requestUrl + '/' + metadata['id'] + '/content'
+        result = {'id': metadata['id'], 'filename': filename, 'size': -1, 'duration': 0.0, 'deduplicated': False, 'error': None}
+        started = time.time()
+        try:
+            path = self.pathFor(metadata)
+            if path is None:
+                result['size'] = client._downloadContent(contentUrl, filename)
+            else:
+                with self._locked(path):
+                    if os.path.exists(path):
+                        result['deduplicated'] = True
+                    else:
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        client._downloadContent(contentUrl, path, checksum=metadata['checksum'], checksumType=metadata.get('checksumType'))
+                self._place(path, filename)
+                result['size'] = os.path.getsize(filename)
+        except Exception as e:
+            result['error'] = str(e)
+        result['duration'] = time.time() - started
+        return result
+
+    ############################################################################
+    # fetch() for many objects, `workers` at a time, into directory.
+    # objects may be metadata dicts or ids; metadata for bare ids is looked up
+    # first, and an id whose lookup fails gets a result with that error.
+    # Files are named like CSSClient.downloadObjects() names them.
+    # Returns one result per object, in the order given.
+
+    def fetchMany(self, client, objects, directory='.', workers=8, requestUrl=None):
+        from concurrent.futures import ThreadPoolExecutor
+        os.makedirs(directory, exist_ok=True)
+        objects = list(objects)
+        ids = [obj for obj in objects if not isinstance(obj, dict)]
+        found = {}
+        errors = {}
+        if ids:
+            found = client.getObjectsMetaData(ids, workers=workers, requestUrl=requestUrl, errors=errors)
+
+        def fetch(metadata):
+            if not isinstance(metadata, dict):
+                if metadata in errors:
+                    return {'id': metadata, 'filename': None, 'size': -1, 'duration': 0.0, 'deduplicated': False, 'error': errors[metadata]}
+                metadata = found[metadata]
+            extension = os.path.splitext(metadata.get('objectName') or '')[1]
+            return self.fetch(client, metadata, os.path.join(directory, metadata['id'] + extension), requestUrl)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(fetch, objects))
+
+# Checksums may arrive as hex or base64. Both are keyed by their hex form.
+def _hexChecksum(checksum):
+    if re.fullmatch(r'[0-9a-fA-F]+', checksum) and len(checksum) % 2 == 0:
+        return checksum.lower()
+    try:
+        return base64.b64decode(checksum, validate=True).hex()
+    except (binascii.Error, ValueError):
+        return re.sub(r'[^A-Za-z0-9_-]', '_', checksum)
+
+
+################################################################################
+# getCSS_ObjectsFromStore() downloads a list of objects into directory through
+# a ContentStore. Content the store already holds is linked into place instead
+# of being downloaded again. Pass the listing from getCSS_ObjectsList() (or a
+# list of ids) and the store directory.
+# It returns a list formatted like this:
+# [{'id': '...', 'filename': 'recordings/....wav', 'size': 48213, 'duration': 0.01, 'deduplicated': True, 'error': None}]
+# ex: getCSS_ObjectsFromStore(token, objectList, 'recordings', store='/data/css_store')
+
+def getCSS_ObjectsFromStore(accessToken, objects, directory='.', store='css_store', workers=8, linkMode='hardlink', requestUrl='https://api.8x8.com/storage/us-west/v3/objects'):
+    client = CSSClient(accessToken, session=_getSharedSession(workers))
+    return ContentStore(store, linkMode).fetchMany(client, objects, directory, workers=workers, requestUrl=requestUrl)
@@ -0,0 +1,158 @@
+# skunkworksSync keeps a local copy of Cloud Storage Service objects up to date
+# without re-listing and re-downloading everything on every run.
+
+# A SQLite index remembers every object that has been fetched: its id, type,
+# objectName, createdTime, updatedTime, storedBytes and checksum. Each run
+# lists objects newest first and stops as soon as it reaches objects older than
+# the high-water mark saved by the last good run. Only objects that are new, or
+# whose updatedTime/storedBytes/checksum changed, are downloaded.
+
+# ex: summary = syncCSS_Objects(token, 'recordings', filter='type==callcenterrecording')
+#     print(summary)
+
+import sqlite3
+import threading
+import time
+
+from skunkworksCSS import CSSClient
+from skunkworksCSS import _getSharedSession
+
+
+################################################################################
+# CSSIndex is the SQLite index behind syncCSS_Objects(). It is safe to share
+# between threads; every call takes the index lock.
+
+class CSSIndex:
+    def __init__(self, filename='css_index.db'):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._db:
+            self._db.execute('''CREATE TABLE IF NOT EXISTS objects (
+                                    id TEXT PRIMARY KEY,
+                                    type TEXT,
+                                    objectName TEXT,
+                                    createdTime TEXT,
+                                    updatedTime TEXT,
+                                    storedBytes INTEGER,
+                                    checksum TEXT,
+                                    filename TEXT,
+                                    syncedAt REAL)''')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS state (
+                                    name TEXT PRIMARY KEY,
+                                    value TEXT)''')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # Returns the indexed row for objectId as a dict, or None.
+    def get(self, objectId):
+        with self._lock:
+            row = self._db.execute('SELECT id, type, objectName, createdTime, updatedTime, storedBytes, checksum, filename, syncedAt FROM objects WHERE id = ?', (objectId,)).fetchone()
+        if row is None:
+            return None
+        keys = ('id', 'type', 'objectName', 'createdTime', 'updatedTime', 'storedBytes', 'checksum', 'filename', 'syncedAt')
+        return dict(zip(keys, row))
+
+    # True if obj (a metadata dict from the listing) is missing from the index
+    # or differs from what was last downloaded.
+    def needsDownload(self, obj):
+        row = self.get(obj['id'])
+        if row is None:
+            return True
+        for field in ('updatedTime', 'storedBytes', 'checksum'):
+            if obj.get(field) is not None and str(obj.get(field)) != str(row[field]):
+                return True
+        return False
+
+    def record(self, obj, filename):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (obj['id'], obj.get('type'), obj.get('objectName'), _text(obj.get('createdTime')),
+                              _text(obj.get('updatedTime')), obj.get('storedBytes'), obj.get('checksum'),
+                              filename, time.time()))
+
+    # The high-water mark is the newest sortField value seen by the last run
+    # that finished without errors.
+    def highWaterMark(self, sortField='updatedTime'):
+        with self._lock:
+            row = self._db.execute('SELECT value FROM state WHERE name = ?', ('hwm:' + sortField,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def setHighWaterMark(self, value, sortField='updatedTime'):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)', ('hwm:' + sortField, value))
+
+def _text(value):
+    if value is None:
+        return None
+    return str(value)
+
+
+################################################################################
+# syncCSS_Objects() brings directory up to date with the objects matching filter.
+#
+# accessToken - token string, skunkworksAuth.TokenProvider, or a CSSClient
+# directory   - where object content is written (see CSSClient.downloadObjects)
+# indexFile   - SQLite index file, created on the first run
+# sortField   - createdTime or updatedTime. Use updatedTime (default) to also
+#               pick up objects that changed after they were created.
+# batchSize   - how many changed objects are collected before downloading
+#
+# The listing is walked newest first and stops at the first object older than
+# the saved high-water mark. Objects with the same timestamp as the mark are
+# checked against the index, so none are skipped.
+# The high-water mark only moves forward when every download succeeded. A run
+# that fails part way is simply repeated next time.
+#
+# Returns a summary:
+# {'listed': n, 'downloaded': n, 'unchanged': n, 'failed': n, 'highWaterMark': value, 'errors': [results]}
+
+def syncCSS_Objects(accessToken, directory='.', indexFile='css_index.db', filter='', sortField='updatedTime', workers=8, batchSize=500, requestUrl=None):
+    if isinstance(accessToken, CSSClient):
+        client = accessToken
+    else:
+        client = CSSClient(accessToken, session=_getSharedSession(workers))
+    index = CSSIndex(indexFile)
+    mark = index.highWaterMark(sortField)
+    newest = None
+    summary = {'listed': 0, 'downloaded': 0, 'unchanged': 0, 'failed': 0, 'highWaterMark': mark, 'errors': []}
+
+    def download(batch):
+        results = client.downloadObjects(batch, directory=directory, workers=workers, requestUrl=requestUrl)
+        for obj, result in zip(batch, results):
+            if result['error'] is None:
+                index.record(obj, result['filename'])
+                summary['downloaded'] += 1
+            else:
+                summary['failed'] += 1
+                summary['errors'].append(result)
+
+    try:
+        batch = []
+        for obj in client.iterObjectsList(filter=filter, sortField=sortField, sortDirection='DESC', requestUrl=requestUrl):
+            value = _text(obj.get(sortField))
+            if mark is not None and value is not None and value < mark:
+                break
+            summary['listed'] += 1
+            if value is not None and (newest is None or value > newest):
+                newest = value
+            if index.needsDownload(obj):
+                batch.append(obj)
+            else:
+                summary['unchanged'] += 1
+            if len(batch) >= batchSize:
+                download(batch)
+                batch = []
+        if batch:
+            download(batch)
+
+        if summary['failed'] == 0 and newest is not None:
+            index.setHighWaterMark(newest, sortField)
+            summary['highWaterMark'] = newest
+    finally:
+        index.close()
+    return summary
@@ -0,0 +1,271 @@
+# skunkworksTable holds large CSS object listings in a compact, column-oriented
+# table instead of a list of json dicts.
+
+# Each field of the listing is stored as one column. Repetitive fields (type,
+# bucketId, customerId, userId, mimeType, objectState, checksumType) are kept
+# as arrays of small integer codes into a table of distinct values, so each
+# distinct string is stored once. storedBytes is a 64 bit integer array. The
+# remaining string fields are plain lists. A few million recordings fit in a
+# fraction of the memory the json dicts need.
+
+# One listing can then drive any number of local selection passes without
+# another API call: filter, sort and group by any of the documented fields,
+# and save/load the table to a binary file.
+
+# ex: table = getCSS_ObjectsTable(token, filter='type==callcenterrecording')
+#     table.save('listing.skwt')
+#     large = ObjectTable.load('listing.skwt').filter(storedBytes=lambda size: size > 10000000)
+#     for objectType, stats in large.groupBy('type').items():
+#         print(objectType, stats['count'], stats['storedBytes'])
+#     ids = large.sort('createdTime', descending=True).column('id')
+
+import json
+import struct
+from array import array
+
+from skunkworksCSS import CSSClient
+from skunkworksCSS import _getSharedSession
+
+# Fields stored as codes into a table of distinct values.
+CODED_FIELDS = ('bucketId', 'customerId', 'userId', 'type', 'mimeType', 'objectState', 'checksumType')
+# Fields stored as plain lists of strings.
+STRING_FIELDS = ('id', 'objectName', 'createdTime', 'updatedTime', 'checksum')
+# Fields stored as 64 bit integers. None is kept as -1.
+INTEGER_FIELDS = ('storedBytes',)
+FIELDS = ('id', 'bucketId', 'customerId', 'userId', 'type', 'mimeType', 'objectName', 'objectState',
+          'createdTime', 'updatedTime', 'storedBytes', 'checksum', 'checksumType')
+
+MAGIC = b'SKWT\x01'
+
+
+################################################################################
+# ObjectTable is the compact listing. Fields that are not in FIELDS are dropped.
+# filter(), sort() and take() return new tables and leave the original alone.
+
+class ObjectTable:
+    def __init__(self):
+        self.rows = 0
+        self.values = dict((field, []) for field in CODED_FIELDS)
+        self.codes = dict((field, {}) for field in CODED_FIELDS)
+        self.columns = {}
+        for field in CODED_FIELDS:
+            self.columns[field] = array('I')
+        for field in STRING_FIELDS:
+            self.columns[field] = []
+        for field in INTEGER_FIELDS:
+            self.columns[field] = array('q')
+
+    @classmethod
+    def fromObjects(cls, objects):
+        table = cls()
+        table.extend(objects)
+        return table
+
+    def __len__(self):
+        return self.rows
+
+    def __iter__(self):
+        for i in range(self.rows):
+            yield self.row(i)
+
+    def _code(self, field, value):
+        codes = self.codes[field]
+        code = codes.get(value)
+        if code is None:
+            code = len(self.values[field])
+            codes[value] = code
+            self.values[field].append(value)
+        return code
+
+    def append(self, obj):
+        for field in CODED_FIELDS:
+            self.columns[field].append(self._code(field, obj.get(field)))
+        for field in STRING_FIELDS:
+            self.columns[field].append(obj.get(field))
+        for field in INTEGER_FIELDS:
+            value = obj.get(field)
+            self.columns[field].append(-1 if value is None else int(value))
+        self.rows = self.rows + 1
+
+    def extend(self, objects):
+        for obj in objects:
+            self.append(obj)
+
+    # The value of field in row i.
+    def value(self, field, i):
+        if field in CODED_FIELDS:
+            return self.values[field][self.columns[field][i]]
+        if field in INTEGER_FIELDS:
+            value = self.columns[field][i]
+            return None if value < 0 else value
+        return self.columns[field][i]
+
+    def row(self, i):
+        return dict((field, self.value(field, i)) for field in FIELDS)
+
+    # All values of field, in row order.
+    def column(self, field):
+        return [self.value(field, i) for i in range(self.rows)]
+
+    # A new table holding the given rows, in the given order.
+    def take(self, indices):
+        table = ObjectTable()
+        for field in CODED_FIELDS:
+            table.values[field] = list(self.values[field])
+            table.codes[field] = dict(self.codes[field])
+            column = self.columns[field]
+            table.columns[field] = array('I', (column[i] for i in indices))
+        for field in STRING_FIELDS:
+            column = self.columns[field]
+            table.columns[field] = [column[i] for i in indices]
+        for field in INTEGER_FIELDS:
+            column = self.columns[field]
+            table.columns[field] = array('q', (column[i] for i in indices))
+        table.rows = len(table.columns['id'])
+        return table
+
+    # Row indices matching every condition. A condition is field=value for an
+    # exact match, or field=callable, called with the value, for anything else.
+    # Exact matches on coded fields compare integer codes, not strings.
+    def indices(self, **conditions):
+        selected = range(self.rows)
+        for field, condition in conditions.items():
+            if field not in FIELDS:
+                raise KeyError(field)
+            column = self.columns[field]
+            if field in CODED_FIELDS and not callable(condition):
+                code = self.codes[field].get(condition)
+                selected = [i for i in selected if column[i] == code] if code is not None else []
+            elif field in CODED_FIELDS:
+                matches = set(code for code, value in enumerate(self.values[field]) if condition(value))
+                selected = [i for i in selected if column[i] in matches]
+            elif callable(condition):
+                selected = [i for i in selected if condition(self.value(field, i))]
+            else:
+                selected = [i for i in selected if self.value(field, i) == condition]
+        return list(selected)
+
+    # ex: table.filter(type='callcenterrecording', storedBytes=lambda size: size > 1000000)
+    def filter(self, **conditions):
+        return self.take(self.indices(**conditions))
+
+    # Rows with no value for field sort first (last when descending).
+    def sort(self, field, descending=False):
+        if field not in FIELDS:
+            raise KeyError(field)
+        column = self.columns[field]
+        if field in CODED_FIELDS:
+            ranked = sorted(range(len(self.values[field])), key=lambda code: _sortKey(self.values[field][code]))
+            rank = [0] * len(ranked)
+            for position, code in enumerate(ranked):
+                rank[code] = position
+            key = lambda i: rank[column[i]]
+        elif field in INTEGER_FIELDS:
+            key = column.__getitem__
+        else:
+            key = lambda i: _sortKey(column[i])
+        return self.take(sorted(range(self.rows), key=key, reverse=descending))
+
+    # {value: {'count': rows, 'storedBytes': total}} for each value of field.
+    def groupBy(self, field):
+        if field not in FIELDS:
+            raise KeyError(field)
+        sizes = self.columns['storedBytes']
+        groups = {}
+        if field in CODED_FIELDS:
+            column = self.columns[field]
+            counts = [0] * len(self.values[field])
+            totals = [0] * len(self.values[field])
+            for i in range(self.rows):
+                counts[column[i]] += 1
+                totals[column[i]] += max(sizes[i], 0)
+            for code, value in enumerate(self.values[field]):
+                if counts[code]:
+                    groups[value] = {'count': counts[code], 'storedBytes': totals[code]}
+            return groups
+        for i in range(self.rows):
+            stats = groups.setdefault(self.value(field, i), {'count': 0, 'storedBytes': 0})
+            stats['count'] += 1
+            stats['storedBytes'] += max(sizes[i], 0)
+        return groups
+
+    ############################################################################
+    # Binary file layout:
+    # MAGIC, 4 byte header length, json header, then one block per column.
+    # The header lists each column's kind and block length, and the distinct
+    # values of the coded columns. Array columns are written as raw
+    # little-endian arrays, string columns as a json list.
+
+    def save(self, filename):
+        blocks = []
+        columns = []
+        for field in FIELDS:
+            column = self.columns[field]
+            if field in STRING_FIELDS:
+                block = json.dumps(column).encode('utf-8')
+                columns.append({'name': field, 'kind': 'string', 'length': len(block)})
+            else:
+                block = _littleEndian(column).tobytes()
+                entry = {'name': field, 'kind': 'coded' if field in CODED_FIELDS else 'integer', 'length': len(block)}
+                if field in CODED_FIELDS:
+                    entry['values'] = self.values[field]
+                columns.append(entry)
+            blocks.append(block)
+        header = json.dumps({'rows': self.rows, 'columns': columns}).encode('utf-8')
+        with open(filename, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            for block in blocks:
+                f.write(block)
+
+    @classmethod
+    def load(cls, filename):
+        table = cls()
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(filename + ' is not an ObjectTable file')
+            headerLength = struct.unpack('<I', f.read(4))[0]
+            header = json.loads(f.read(headerLength).decode('utf-8'))
+            for entry in header['columns']:
+                block = f.read(entry['length'])
+                field = entry['name']
+                if entry['kind'] == 'string':
+                    table.columns[field] = json.loads(block.decode('utf-8'))
+                else:
+                    column = array('I' if entry['kind'] == 'coded' else 'q')
+                    column.frombytes(block)
+                    table.columns[field] = _littleEndian(column)
+                    if entry['kind'] == 'coded':
+                        table.values[field] = entry['values']
+                        table.codes[field] = dict((value, code) for code, value in enumerate(entry['values']))
+        table.rows = header['rows']
+        return table
+
+# Sorts None before any string.
+def _sortKey(value):
+    return (value is not None, value)
+
+# Arrays are stored little-endian; swap on big-endian machines.
+def _littleEndian(column):
+    import sys
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+################################################################################
+# getCSS_ObjectsTable() lists objects straight into an ObjectTable. It takes
+# the same arguments as getCSS_ObjectsList(), and accessToken may also be a
+# CSSClient. Without requestUrl the listing goes to the client's own region
+# and baseUrl (us-west for a plain token). The json for each page is dropped
+# as soon as it is added to the table, so peak memory stays close to the size
+# of the table itself.
+
+def getCSS_ObjectsTable(accessToken, requestUrl=None, filter='', pageKey=0, limit=100, sortField='createdTime', sortDirection='DESC', workers=1):
+    if isinstance(accessToken, CSSClient):
+        client = accessToken
+    else:
+        client = CSSClient(accessToken, session=_getSharedSession(workers))
+    return ObjectTable.fromObjects(client.iterObjectsList(filter=filter, pageKey=pageKey, limit=limit, sortField=sortField, sortDirection=sortDirection, requestUrl=requestUrl, workers=workers))